@@ -0,0 +1,112 @@
+# Purpose: opt-in per api call instrumentation of aws clients.
+#
+# Run any script with --api-stats (or --api-stats=<file.json> to also dump
+# raw timings) to get a table of calls, retries, throttles, response bytes
+# and p50/p95/p99 latency per (service, operation, region, profile) on
+# stderr at exit. The option is removed from sys.argv when aws_clients is
+# imported, before the script parses its own arguments.
+# Latency is measured with botocore events, from before-call to after-call,
+# so it includes retries and rate limiting of the call.
+
+import sys, json, math, time, atexit, threading
+from aws_retry import throttle_codes
+
+option = "--api-stats"
+enabled = False
+dump_file = None
+
+timings = {}
+counters = {}
+lock = threading.Lock()
+
+def enable_from_argv(argv):
+    """Enables stats when argv has --api-stats[=<file.json>], and removes it from argv."""
+    global enabled, dump_file
+    for arg in list(argv[1:]):
+        if arg == option or arg.startswith(option + "="):
+            argv.remove(arg)
+            enabled = True
+            dump_file = arg.partition("=")[2] or dump_file
+    if enabled:
+        atexit.register(report)
+
+def get_counters(key):
+    if key not in counters:
+        counters[key] = {"calls": 0, "errors": 0, "retries": 0, "throttles": 0, "bytes": 0}
+        timings[key] = []
+    return counters[key]
+
+def instrument(client, profile):
+    """Registers event handlers that record every call of client."""
+    service = client.meta.service_model.service_name
+    region = client.meta.region_name
+    events = client.meta.events
+
+    def before_call(model, context, **kwargs):
+        context["api_stats_start"] = time.perf_counter()
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        elapsed = time.perf_counter() - context.get("api_stats_start", time.perf_counter())
+        with lock:
+            c = get_counters((service, model.name, region, profile))
+            c["calls"] += 1
+            c["errors"] += http_response.status_code >= 300
+            c["retries"] += parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            c["bytes"] += int(http_response.headers.get("content-length", 0) or 0)
+            timings[(service, model.name, region, profile)].append(elapsed)
+
+    def after_call_error(context, event_name, **kwargs):
+        # connection errors, no http response, event is after-call-error.<service>.<operation>
+        elapsed = time.perf_counter() - context.get("api_stats_start", time.perf_counter())
+        key = (service, event_name.rsplit(".", 1)[-1], region, profile)
+        with lock:
+            c = get_counters(key)
+            c["calls"] += 1
+            c["errors"] += 1
+            timings[key].append(elapsed)
+
+    def needs_retry(response, operation, **kwargs):
+        # called for every attempt, counts the throttled ones
+        if response is not None and response[1].get("Error", {}).get("Code") in throttle_codes:
+            with lock:
+                get_counters((service, operation.name, region, profile))["throttles"] += 1
+
+    # first, so a before-call handler that answers the call does not hide it
+    events.register_first("before-call", before_call)
+    events.register("after-call", after_call)
+    events.register("after-call-error", after_call_error)
+    events.register("needs-retry", needs_retry)
+
+def percentile(values, p):
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+def summary():
+    """Returns list of rows, slowest total time first."""
+    rows = []
+    with lock:
+        for key, c in counters.items():
+            values = sorted(timings[key])
+            rows.append(dict(zip(("service", "operation", "region", "profile"), key), **c,
+                             total=sum(values), p50=percentile(values, 50), p95=percentile(values, 95), p99=percentile(values, 99)))
+    return sorted(rows, key=lambda row: -row["total"])
+
+def print_summary(rows):
+    print(f"{'service':12} {'operation':36} {'region':16} {'profile':20} {'calls':>7} {'errors':>6} {'retries':>7} {'throttles':>9} {'bytes':>11} {'total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}", file=sys.stderr)
+    for r in rows:
+        print(f"{r['service']:12} {r['operation']:36} {str(r['region']):16} {str(r['profile']):20} {r['calls']:7d} {r['errors']:6d} {r['retries']:7d} {r['throttles']:9d} {r['bytes']:11d} {r['total']:8.2f} {r['p50'] * 1000:8.1f} {r['p95'] * 1000:8.1f} {r['p99'] * 1000:8.1f}", file=sys.stderr)
+    print(f"Total {sum(r['calls'] for r in rows)} api calls, {sum(r['throttles'] for r in rows)} throttled", file=sys.stderr)
+
+def dump(path):
+    with lock:
+        data = [dict(zip(("service", "operation", "region", "profile"), key), **counters[key], timings=timings[key])
+                for key in counters]
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+
+def report():
+    print_summary(summary())
+    if dump_file:
+        dump(dump_file)
@@ -0,0 +1,87 @@
+# Purpose: single entry point for all reports and searches, e.g.
+#   aws-reports.py ec2-search -n web -c
+#   aws-reports.py sg-unrestricted-access-report -d
+# Only the script of the given subcommand is loaded, and the scripts load
+# boto3 only when they create a session, so listing subcommands, --help
+# and queries answered from local snapshots start fast.
+# ec2-search and r53-search are sent to reports-daemon.py when it runs (its
+# socket exists), and run here when the daemon does not answer them (it
+# answers only queries of its in-memory inventory, see reports-daemon.py).
+# Set AWS_REPORTS_NO_DAEMON=1 to always run them here. Queries with
+# --api-stats are run here too, so the stats cover only that query.
+#
+# Author Predrag Vlajkovic, 2024
+
+import os, sys, runpy
+from cache_paths import cache_path
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# socket of reports-daemon.py, cache_path is imported instead of the daemon
+socket_file = cache_path("reports.sock")
+daemon_commands = ("ec2-search", "r53-search")
+
+commands = {
+    "ec2-search": "search ec2 instances by name, region, status, tag value or id",
+    "ec2-volumes": "search ec2 instances and list their ebs volumes",
+    "ec2-fix-tags": "fix AvailabilityZone tags of ec2 instances",
+    "inventory-refresh": "refresh local inventory snapshot",
+    "r53-search": "search route53 zones or records",
+    "r53-reverse-search": "find route53 records pointing at ips or dns names",
+    "sg-unrestricted-access-report": "security group rules open to 0.0.0.0/0",
+    "vpc-empty-report": "vpcs with few or no ec2/rds/lambda resources",
+    "vpc-inside": "resources inside one or all vpcs of a region",
+    "s3-posture-report": "all s3 reports from one sweep of buckets",
+    "s3-missing-pab-block-report": "s3 buckets without public access block",
+    "s3-http-access-report": "s3 buckets without deny http policy",
+    "s3-search-template": "s3 bucket versioning, public access block and policy",
+    "reports-daemon": "keep sessions and inventory warm, answer searches over a unix socket",
+}
+
+def print_usage():
+    print ("Usage: aws-reports.py <command> [command options], options of a command: aws-reports.py <command> -h")
+    print ("")
+    for command, description in commands.items():
+        print (f"   {command:32} {description}")
+
+def run_in_daemon(command, argv):
+    """Returns exit code of command answered by reports-daemon.py, None when no daemon answered it."""
+    if command not in daemon_commands or os.environ.get("AWS_REPORTS_NO_DAEMON") or not os.path.exists(socket_file):
+        return None
+    if any(arg == "--api-stats" or arg.startswith("--api-stats=") for arg in argv):
+        return None
+    import socket, json
+    try:
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(socket_file)
+            s.sendall((json.dumps({"command": command, "argv": argv, "cwd": os.getcwd()}) + "\n").encode())
+            with s.makefile(encoding="utf-8") as f:
+                reply = json.loads(f.readline())
+    except (OSError, ValueError):
+        return None
+    if "error" in reply:
+        return None
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["exit_code"]
+
+def main(argv):
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        sys.exit()
+    command = argv[0]
+    if command not in commands:
+        print (f"Unknown command {command}")
+        print_usage()
+        sys.exit(2)
+
+    exit_code = run_in_daemon(command, argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    script = os.path.join(script_dir, f"{command}.py")
+    sys.argv = [script] + argv[1:]
+    sys.path.insert(0, script_dir)
+    runpy.run_path(script, run_name="__main__")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+# Purpose: shared cache of boto3 sessions and clients.
+#
+# Clients are kept per (profile, service, region) with a sized connection
+# pool and LRU eviction, so hot functions can ask for a client every time
+# without re-loading the service model or opening new TLS connections.
+# A client takes ~1 MB, so one-shot scripts keep only the most recent
+# max_clients of them (a fan-out over profiles and regions uses each one
+# for its own unit), long running processes (reports-daemon.py) keep all
+# with set_max_clients.
+# All sessions share one botocore loader, so a service model is read from
+# disk once per process, not once per profile. The first client of a service
+# is created under one lock, otherwise workers of different profiles starting
+# together each parse their own copy of the model before the loader has it.
+# Clients retry and rate limit throttled calls, see aws_retry.py.
+# Role and SSO credentials are cached on disk across runs, see
+# credential_cache.py.
+# boto3 is imported with the first session, so --help and queries answered
+# from local snapshots do not pay for it.
+#
+# Set AWS_CLIENT_STATS=1 to print hit/miss counters at exit, run a script
+# with --api-stats for per api call stats (see api_stats.py).
+
+import os, sys, time, atexit, threading
+from contextlib import nullcontext
+from collections import OrderedDict
+from aws_retry import retry_config
+import api_stats
+from credential_cache import use_cache
+
+max_clients = 32
+max_pool_connections = 32
+
+sessions = {}
+clients = OrderedDict()
+stats = {"hits": 0, "misses": 0, "evictions": 0, "create_seconds": 0.0}
+
+shared_loader = None
+cache_lock = threading.Lock()
+# boto3 sessions are not thread safe, clients of one profile are created under its lock
+profile_locks = {}
+# services whose model is in the shared loader, the first client of each is created under model_lock
+loaded_services = set()
+model_lock = threading.Lock()
+
+def get_session(profile=None):
+    """Returns cached boto3 session of the profile, None means default profile."""
+    global shared_loader
+    with cache_lock:
+        if profile not in sessions:
+            import boto3, botocore.session, botocore.loaders
+            if shared_loader is None:
+                shared_loader = botocore.loaders.create_loader()
+            core_session = botocore.session.Session(profile=profile)
+            core_session.register_component('data_loader', shared_loader)
+            # raises ProfileNotFound now, like boto3.Session(profile_name=...) does
+            core_session.get_scoped_config()
+            use_cache(core_session)
+            sessions[profile] = boto3.Session(botocore_session=core_session)
+        return sessions[profile]
+
+def set_max_clients(count):
+    global max_clients
+    max_clients = count
+
+def get_client(session, service, region_name=None):
+    """Returns cached client of the session's profile for service and region."""
+    profile = session.profile_name
+    key = (profile, service, region_name)
+    with cache_lock:
+        if key in clients:
+            clients.move_to_end(key)
+            stats["hits"] += 1
+            return clients[key]
+        lock = profile_locks.setdefault(profile, threading.Lock())
+        first = service not in loaded_services
+
+    with model_lock if first else nullcontext(), lock:
+        with cache_lock:
+            if key in clients:
+                stats["hits"] += 1
+                return clients[key]
+        from botocore.config import Config
+        start = time.perf_counter()
+        client = session.client(service, region_name=region_name, config=Config(max_pool_connections=max_pool_connections, retries=retry_config))
+        if api_stats.enabled:
+            api_stats.instrument(client, profile)
+        elapsed = time.perf_counter() - start
+        loaded_services.add(service)
+
+    with cache_lock:
+        stats["misses"] += 1
+        stats["create_seconds"] += elapsed
+        clients[key] = client
+        while len(clients) > max_clients:
+            clients.popitem(last=False)
+            stats["evictions"] += 1
+    return client
+
+def stats_summary():
+    misses = stats["misses"]
+    average = stats["create_seconds"] / misses if misses else 0.0
+    return (f"clients: {stats['hits']} hits, {misses} misses, {stats['evictions']} evictions, "
+            f"{stats['create_seconds']:.2f}s spent creating, ~{stats['hits'] * average:.2f}s saved")
+
+def print_stats():
+    print(stats_summary(), file=sys.stderr)
+
+if os.environ.get("AWS_CLIENT_STATS"):
+    atexit.register(print_stats)
+
+api_stats.enable_from_argv(sys.argv)
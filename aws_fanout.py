@@ -0,0 +1,52 @@
+# Purpose: run independent (profile, region) work units on a bounded
+# thread pool, with a cap on how many units of one account run at once.
+#
+# Used by the multi-account scripts, which spend nearly all of their time
+# waiting on the network, one profile and one region after another.
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+default_max_workers = 16
+default_per_account = 4
+
+def run_units(units, worker, max_workers=default_max_workers, per_account=default_per_account, ordered=False):
+    """
+    Run worker(unit) for every unit and yield (unit, result) pairs.
+
+    unit[0] is the account key (profile name) used for the per-account cap.
+    With ordered=True pairs are yielded in the order of units, otherwise as
+    soon as they complete. Exceptions raised by worker are re-raised here.
+    """
+    units = list(units)
+    pending = list(range(len(units)))
+    running = {}
+    per_key = {}
+    done = {}
+    next_index = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # submit whatever fits under the global and per-account caps
+            waiting = []
+            for i in pending:
+                key = units[i][0]
+                if len(running) < max_workers and per_key.get(key, 0) < per_account:
+                    running[executor.submit(worker, units[i])] = i
+                    per_key[key] = per_key.get(key, 0) + 1
+                else:
+                    waiting.append(i)
+            pending = waiting
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = running.pop(future)
+                per_key[units[i][0]] -= 1
+                result = future.result()
+                if not ordered:
+                    yield units[i], result
+                else:
+                    done[i] = result
+
+            while ordered and next_index in done:
+                yield units[next_index], done.pop(next_index)
+                next_index += 1
@@ -0,0 +1,22 @@
+# Purpose: generator over all pages of describe/list api calls.
+#
+# Scripts iterate resources as pages arrive instead of reading only the
+# first page, so the first result is printed early and memory use does
+# not depend on the size of the fleet.
+
+import jmespath
+
+def iterate(client, operation, expression, **kwargs):
+    """
+    Yields items selected by jmespath expression (e.g. 'Reservations[].Instances[]')
+    from every page of client.operation(**kwargs). Operations without a
+    paginator are called once.
+    """
+    if client.can_paginate(operation):
+        for item in client.get_paginator(operation).paginate(**kwargs).search(expression):
+            if item is not None:
+                yield item
+    else:
+        response = getattr(client, operation)(**kwargs)
+        for item in jmespath.search(expression, response) or []:
+            yield item
@@ -0,0 +1,62 @@
+# Purpose: find regions enabled in an aws account/profile.
+# Regions are probed in parallel with sts get_caller_identity and the
+# result is kept on disk per profile, so repeated report runs skip the
+# discovery until the cache entry expires.
+
+import os, json, time
+import botocore.exceptions
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_client
+from cache_paths import cache_path
+
+cache_dir = cache_path("regions")
+default_ttl = 24 * 3600
+default_max_workers = 16
+
+def cache_file(profile, service):
+    return os.path.join(cache_dir, f"{profile}.{service}.json")
+
+def read_cache(profile, service, ttl):
+    try:
+        with open(cache_file(profile, service)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - cached.get("time", 0) > ttl:
+        return None
+    return cached["regions"]
+
+def write_cache(profile, service, regions):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_file(profile, service)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"time": time.time(), "regions": regions}, f)
+    os.replace(tmp_path, path)
+
+def is_region_enabled(session, region):
+    sts_client = get_client(session, 'sts', region_name=region)
+    try:
+        sts_client.get_caller_identity()
+        return True
+    except botocore.exceptions.ClientError as e:
+        if e.response['Error']['Code'] == "InvalidClientTokenId":
+            return False
+        raise
+
+def get_enabled_regions(session, service, ttl=default_ttl, max_workers=default_max_workers):
+    """
+    Returns sorted list of regions where service is available and enabled
+    for the session's profile. ttl=0 forces a fresh probe.
+    """
+    profile = session.profile_name
+    regions = read_cache(profile, service, ttl) if ttl > 0 else None
+    if regions is not None:
+        return regions
+
+    regions = session.get_available_regions(service)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        enabled = list(executor.map(lambda region: is_region_enabled(session, region), regions))
+    regions = sorted(region for region, is_enabled in zip(regions, enabled) if is_enabled)
+    write_cache(profile, service, regions)
+    return regions
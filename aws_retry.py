@@ -0,0 +1,26 @@
+# Purpose: shared rate limiting and retry settings for all aws clients,
+# and telling throttles apart from real errors.
+#
+# Clients from aws_clients.get_client use botocore's adaptive retry mode.
+# Each client has its own token bucket, and clients are cached one per
+# (profile, service, region), so there is one bucket per account, service
+# and region. The bucket's send rate drops when the api throttles and grows
+# back while calls succeed. Throttled and transient failures are retried
+# with exponential backoff and jitter, inside the call. Any other error is
+# raised right away as a ClientError.
+
+max_attempts = 10
+retry_config = {"mode": "adaptive", "total_max_attempts": max_attempts}
+
+throttle_codes = {"SlowDown", "Throttling", "ThrottlingException", "ThrottledException", "RequestLimitExceeded",
+                  "RequestThrottled", "RequestThrottledException", "TooManyRequestsException",
+                  "ProvisionedThroughputExceededException", "BandwidthLimitExceeded", "EC2ThrottledException",
+                  "PriorRequestNotComplete", "503"}
+
+def error_code(e):
+    return e.response.get('Error', {}).get('Code', "")
+
+def is_throttle(e):
+    """True when ClientError e means 'slow down' rather than a real error."""
+    return (error_code(e) in throttle_codes
+            or e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') in (429, 503))
@@ -0,0 +1,221 @@
+# Purpose: synthetic multi-account aws stand-in for benchmarks, and the
+# runner of one script against it.
+#
+# Every botocore client gets a before-call handler that answers the call
+# from generated data, after sleeping the configured latency, so no
+# request leaves the machine. The data is deterministic per profile and
+# region, sized by the counts in the model settings (see default_model).
+# Operations without a generator return empty lists.
+#
+# Usage (by run-bench.py): fake_aws.py <model.json> <result.json> <script> [args]
+
+import os, sys, json, time, runpy, resource, threading
+from functools import lru_cache
+from collections import Counter
+import botocore.session
+
+regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2", "ca-central-1", "sa-east-1",
+           "eu-west-1", "eu-west-2", "eu-west-3", "eu-central-1", "eu-north-1",
+           "ap-south-1", "ap-northeast-1", "ap-northeast-2", "ap-northeast-3", "ap-southeast-1", "ap-southeast-2"]
+
+default_model = {
+    "accounts": 27,
+    "regions": 17,
+    "latency": 0.02,
+    "vpcs": 3,
+    "instances": 20,
+    "security_groups": 10,
+    "rules": 4,
+    "db_instances": 2,
+    "functions": 5,
+    "nat_gateways": 1,
+    "subnets": 3,
+    "buckets": 20,
+    "page_size": 50,
+}
+
+model = dict(default_model)
+calls = Counter()
+lock = threading.Lock()
+
+def get_profiles(model):
+    return [f"account-{i:02d}" for i in range(1, model["accounts"] + 1)]
+
+def get_regions(model):
+    return regions[:model["regions"]]
+
+class Response:
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = b""
+        self.raw = None
+
+def error(code, status_code=400):
+    return Response(status_code), {"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status_code}}
+
+@lru_cache(maxsize=None)
+def get_data(profile, region):
+    """Resources of profile in region, VpcIds spread round robin."""
+    vpcs = [{"VpcId": f"vpc-{profile}-{region}-{v}", "CidrBlock": f"10.{v}.0.0/16", "IsDefault": v == 0,
+             "Tags": [{"Key": "Name", "Value": f"vpc-{v}"}]} for v in range(model["vpcs"])]
+    vpc = lambda i: vpcs[i % len(vpcs)]["VpcId"] if vpcs else None
+    azs = [f"{region}a", f"{region}b"]
+    instances = [{"InstanceId": f"i-{profile}-{region}-{i}", "State": {"Name": "running" if i % 4 else "stopped"},
+                  "Placement": {"AvailabilityZone": azs[i % 2]}, "VpcId": vpc(i),
+                  "BlockDeviceMappings": [{"Ebs": {"VolumeId": f"vol-{profile}-{region}-{i}"}}],
+                  "Tags": [{"Key": "Name", "Value": f"web-{i}"}, {"Key": "AvailabilityZone", "Value": azs[(i // 5) % 2]}]}
+                 for i in range(model["instances"])]
+    groups = [{"GroupId": f"sg-{profile}-{region}-{g}", "GroupName": f"sg-{g}", "VpcId": vpc(g)} for g in range(model["security_groups"])]
+    rules = [{"SecurityGroupRuleId": f"sgr-{group['GroupId']}-{r}", "GroupId": group["GroupId"], "IsEgress": r == 0,
+              "IpProtocol": "tcp", "FromPort": 22 + r, "ToPort": 22 + r,
+              "CidrIpv4": "0.0.0.0/0" if r % 2 else "10.0.0.0/8"}
+             for group in groups for r in range(model["rules"])]
+    subnets = [{"SubnetId": f"subnet-{profile}-{region}-{s}", "VpcId": vpc(s)} for s in range(model["subnets"] * len(vpcs))]
+    return {
+        "vpcs": vpcs,
+        "instances": instances,
+        "groups": groups,
+        "rules": rules,
+        "subnets": subnets,
+        "db_instances": [{"DBInstanceIdentifier": f"db-{d}", "DBSubnetGroup": {"VpcId": vpc(d)}} for d in range(model["db_instances"])],
+        "functions": [{"FunctionName": f"fn-{f}", "VpcConfig": {"VpcId": vpc(f)}} for f in range(model["functions"])],
+        "nat_gateways": [{"NatGatewayId": f"nat-{n}", "VpcId": vpc(n)} for n in range(model["nat_gateways"])],
+    }
+
+filter_fields = {"vpc-id": "VpcId", "instance-id": "InstanceId", "group-id": "GroupId"}
+
+def apply_filters(items, params):
+    for f in params.get("Filters", []):
+        field = filter_fields.get(f["Name"])
+        if field:
+            items = [item for item in items if item.get(field) in f["Values"]]
+    return items
+
+def page(items, params, key, token="NextToken", size_param="MaxResults"):
+    start = int(params.get(token) or 0)
+    end = start + (params.get(size_param) or model["page_size"])
+    response = {key: items[start:end]}
+    if end < len(items):
+        response[token] = str(end)
+    return response
+
+def op_DescribeRegions(profile, region, params):
+    return {"Regions": [{"RegionName": r} for r in get_regions(model)]}
+
+def op_GetCallerIdentity(profile, region, params):
+    if region not in get_regions(model):
+        return error("InvalidClientTokenId", 403)
+    return {"Account": profile, "Arn": f"arn:aws:iam::{profile}:user/bench", "UserId": "bench"}
+
+def op_DescribeVpcs(profile, region, params):
+    return page(apply_filters(get_data(profile, region)["vpcs"], params), params, "Vpcs")
+
+def op_DescribeInstances(profile, region, params):
+    instances = apply_filters(get_data(profile, region)["instances"], params)
+    response = page(instances, params, "Reservations")
+    response["Reservations"] = [{"Instances": [instance]} for instance in response["Reservations"]]
+    return response
+
+def op_DescribeSecurityGroups(profile, region, params):
+    return page(apply_filters(get_data(profile, region)["groups"], params), params, "SecurityGroups")
+
+def op_DescribeSecurityGroupRules(profile, region, params):
+    return page(apply_filters(get_data(profile, region)["rules"], params), params, "SecurityGroupRules")
+
+def op_DescribeSubnets(profile, region, params):
+    return page(apply_filters(get_data(profile, region)["subnets"], params), params, "Subnets")
+
+def op_DescribeNatGateways(profile, region, params):
+    return page(apply_filters(get_data(profile, region)["nat_gateways"], params), params, "NatGateways")
+
+def op_DescribeDBInstances(profile, region, params):
+    return page(get_data(profile, region)["db_instances"], params, "DBInstances", "Marker", "MaxRecords")
+
+def op_ListFunctions(profile, region, params):
+    return page(get_data(profile, region)["functions"], params, "Functions", "Marker", "MaxItems")
+
+def op_ListBuckets(profile, region, params):
+    return {"Buckets": [{"Name": f"{profile}-bucket-{b}"} for b in range(model["buckets"])]}
+
+def bucket_number(params):
+    return int(params["Bucket"].rsplit("-", 1)[1])
+
+def op_GetBucketVersioning(profile, region, params):
+    return {"Status": "Enabled"} if bucket_number(params) % 2 else {}
+
+def op_GetPublicAccessBlock(profile, region, params):
+    if bucket_number(params) % 3:
+        return error("NoSuchPublicAccessBlockConfiguration", 404)
+    return {"PublicAccessBlockConfiguration": {"BlockPublicAcls": True, "IgnorePublicAcls": True,
+                                               "BlockPublicPolicy": True, "RestrictPublicBuckets": True}}
+
+def op_GetBucketPolicy(profile, region, params):
+    if bucket_number(params) % 4:
+        return error("NoSuchBucketPolicy", 404)
+    return {"Policy": json.dumps({"Statement": [{"Effect": "Deny", "Condition": {"Bool": {"aws:SecureTransport": "false"}}}]})}
+
+def op_GetBucketLocation(profile, region, params):
+    return {"LocationConstraint": None}
+
+def empty_response(operation_model):
+    """Empty lists for all list members of the output, so searches see no resources."""
+    shape = operation_model.output_shape
+    if shape is None:
+        return {}
+    return {name: [] for name, member in shape.members.items() if member.type_name == "list"}
+
+def install():
+    """Makes every botocore client created from now on answer from the stand-in."""
+    create_client = botocore.session.Session.create_client
+
+    def fake_create_client(self, *args, **kwargs):
+        client = create_client(self, *args, **kwargs)
+        profile = self.profile
+        region = client.meta.region_name
+
+        def keep_params(params, context, **kw):
+            context["fake_params"] = dict(params)
+
+        def answer(context, **kw):
+            operation = kw["model"]
+            with lock:
+                calls[(client.meta.service_model.service_name, operation.name)] += 1
+            time.sleep(model["latency"])
+            handler = globals().get("op_" + operation.name)
+            if handler is None:
+                return Response(), empty_response(operation)
+            result = handler(profile, region, context.get("fake_params", {}))
+            return result if isinstance(result, tuple) else (Response(), result)
+
+        client.meta.events.register("before-parameter-build", keep_params)
+        client.meta.events.register("before-call", answer)
+        return client
+
+    botocore.session.Session.create_client = fake_create_client
+
+def main(argv):
+    model_file, result_file, script = argv[:3]
+    with open(model_file) as f:
+        model.update(json.load(f))
+    install()
+
+    sys.argv = [script] + argv[3:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    exit_code = 0
+    start = time.perf_counter()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    seconds = time.perf_counter() - start
+    # kilobytes on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    with open(result_file, "w") as f:
+        json.dump({"seconds": seconds, "peak_bytes": peak, "exit_code": exit_code,
+                   "calls": sum(calls.values()),
+                   "operations": {f"{service}.{operation}": count for (service, operation), count in sorted(calls.items())}}, f, indent=1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,248 @@
+# Purpose: offline benchmark of the report and search scripts against a
+# synthetic multi-account aws stand-in (see fake_aws.py).
+#
+# Every benchmark runs one script in its own process, with a generated
+# config.yaml and aws config of the model's profiles, and a fresh cache
+# directory, so it starts cold. Records wall time, api calls and peak
+# memory, and fails when a script goes over any of its budgets in
+# budgets.yaml (budgets apply to the model they were recorded with).
+# --update records the worst of a few runs, peak memory and wall time with
+# headroom and slack, as they vary between runs and machines.
+# Cold start of aws-reports.py (--help, and queries answered from a local
+# snapshot primed against the stand-in) is measured as median of a few runs.
+#
+# Author Predrag Vlajkovic, 2024
+
+import os, sys, json, math, time, getopt, tempfile, subprocess, yaml
+from fake_aws import default_model, get_profiles
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+budgets_file = os.path.join(bench_dir, "budgets.yaml")
+memory_headroom = 1.25
+memory_slack_mb = 32
+time_headroom = 1.5
+time_slack = 1.0
+update_runs = 3
+
+benchmarks = [
+    ("ec2-search", "ec2-search.py", []),
+    ("vpc-empty-report", "vpc-empty-report.py", []),
+    ("sg-unrestricted-access-report", "sg-unrestricted-access-report.py", []),
+    ("vpc-inside", "vpc-inside.py", ["-a", "-r", "us-east-1", "-p", "account-01"]),
+    ("s3-posture-report", "s3-posture-report.py", []),
+    ("s3-http-access-report", "s3-http-access-report.py", []),
+    ("s3-missing-pab-block-report", "s3-missing-pab-block-report.py", []),
+    ("s3-search-template", "s3-search-template.py", []),
+]
+
+# (name, aws-reports.py arguments, script and arguments priming the snapshot or None)
+cold_starts = [
+    ("aws-reports --help", ["-h"], None),
+    ("ec2-search --help", ["ec2-search", "-h"], None),
+    ("ec2-search cached", ["ec2-search", "-c", "-n", "web-1"], ["ec2-search.py", "-c"]),
+    ("r53-search cached", ["r53-search", "-q", "*.example.com"], ["r53-search.py", "-q", "*.example.com"]),
+]
+cold_start_runs = 5
+
+def process_cli_arguments (argv):
+    parameters = [dict(default_model), "", False, False]
+    try:
+        opts, args = getopt.getopt(argv,"a:r:l:c:s:uvh",["accounts=","regions=","latency=","counts=","select=","update","verbose","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   run-bench.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: run-bench.py --accounts <n> --regions <n> --latency <ms> --counts <name=n,...> --select <benchmark> --update --verbose")
+            print ("   or: run-bench.py -a <n> -r <n> -l <ms> -c <name=n,...> -s <benchmark> -u -v")
+            print (f"   Assumed {default_model['accounts']} accounts, {default_model['regions']} regions and {default_model['latency'] * 1000:.0f} ms per api call if not specified")
+            print ("   --counts (-c) resources per account and region, e.g. instances=100,vpcs=5, see default_model in fake_aws.py")
+            print ("   --select (-s) runs only benchmarks whose name contains the value")
+            print (f"   --update (-u) records api calls, peak memory and wall time of the worst of {update_runs} runs as the new budgets")
+            print ("   --verbose (-v) shows output of the scripts")
+            sys.exit()
+        elif opt in ("-a", "--accounts"):
+            parameters[0]["accounts"]=int(arg)
+        elif opt in ("-r", "--regions"):
+            parameters[0]["regions"]=int(arg)
+        elif opt in ("-l", "--latency"):
+            parameters[0]["latency"]=float(arg) / 1000
+        elif opt in ("-c", "--counts"):
+            for count in arg.split(","):
+                name, value = count.split("=")
+                if name not in default_model:
+                    print (f"Unknown count {name}, known are: {', '.join(default_model)}")
+                    sys.exit(2)
+                parameters[0][name]=int(value)
+        elif opt in ("-s", "--select"):
+            parameters[1]=arg
+        elif opt in ("-u", "--update"):
+            parameters[2]=True
+        elif opt in ("-v", "--verbose"):
+            parameters[3]=True
+        else:
+            assert False, "unhandled option"
+
+    return parameters
+
+def load_budgets():
+    try:
+        with open(budgets_file) as f:
+            return yaml.safe_load(f) or {}
+    except OSError:
+        return {}
+
+def write_environment(work_dir, model):
+    """
+    Writes config.yaml of the model's profiles and aws config with static
+    keys for them, returns environment of the scripts.
+    """
+    with open(os.path.join(repo_dir, "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    config["profiles"] = get_profiles(model)
+    with open(os.path.join(work_dir, "config.yaml"), "w") as f:
+        yaml.safe_dump(config, f)
+    with open(os.path.join(work_dir, "aws_config"), "w") as f:
+        for profile in ["default"] + config["profiles"]:
+            section = profile if profile == "default" else f"profile {profile}"
+            f.write(f"[{section}]\nregion = us-east-1\naws_access_key_id = bench\naws_secret_access_key = bench\n")
+    with open(os.path.join(work_dir, "model.json"), "w") as f:
+        json.dump(model, f)
+    env = dict(os.environ,
+               AWS_CONFIG_FILE=os.path.join(work_dir, "aws_config"),
+               AWS_SHARED_CREDENTIALS_FILE=os.path.join(work_dir, "credentials"),
+               AWS_REPORTS_CACHE=os.path.join(work_dir, ".cache"),
+               AWS_EC2_METADATA_DISABLED="true")
+    env.pop("AWS_PROFILE", None)
+    return env
+
+def run_fake(work_dir, env, script, args, verbose):
+    """Runs script against the stand-in, returns result of fake_aws.py, None when the script failed."""
+    result_file = os.path.join(work_dir, "result.json")
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.run([sys.executable, os.path.join(bench_dir, "fake_aws.py"), os.path.join(work_dir, "model.json"),
+                              result_file, os.path.join(repo_dir, script)] + args,
+                             cwd=work_dir, env=env, stdout=output, stderr=output)
+    if process.returncode != 0 or not os.path.exists(result_file):
+        return None
+    with open(result_file) as f:
+        result = json.load(f)
+    # fake_aws.py exits 0 when the script calls sys.exit, its exit code is in the result
+    if result["exit_code"] != 0:
+        return None
+    return result
+
+def get_budget(budgets, name):
+    """Returns {calls, peak_mb, seconds} budget of the benchmark, a plain number is an api call budget."""
+    budget = budgets.get("budgets", {}).get(name) or {}
+    return {"calls": budget} if isinstance(budget, int) else budget
+
+def check_budget(result, budget):
+    """Returns list of the budgets the result is over."""
+    over = []
+    if "calls" in budget and result["calls"] > budget["calls"]:
+        over.append(f"{result['calls'] - budget['calls']} api calls")
+    peak_mb = result["peak_bytes"] / 2**20
+    if "peak_mb" in budget and peak_mb > budget["peak_mb"]:
+        over.append(f"{peak_mb - budget['peak_mb']:.1f} MB")
+    if "seconds" in budget and result["seconds"] > budget["seconds"]:
+        over.append(f"{result['seconds'] - budget['seconds']:.2f} seconds")
+    return over
+
+def new_budget(results):
+    """Budget of the worst of the results."""
+    return {"calls": max(result["calls"] for result in results),
+            "peak_mb": math.ceil(max(result["peak_bytes"] for result in results) / 2**20 * memory_headroom + memory_slack_mb),
+            "seconds": math.ceil((max(result["seconds"] for result in results) * time_headroom + time_slack) * 10) / 10}
+
+def run_benchmark(script, args, model, verbose):
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = write_environment(work_dir, model)
+        return run_fake(work_dir, env, script, args, verbose)
+
+def measure_cold_start(args, prime, model, verbose):
+    """Returns median seconds of aws-reports.py args, None when it failed."""
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = write_environment(work_dir, model)
+        if prime and run_fake(work_dir, env, prime[0], prime[1:], verbose) is None:
+            return None
+        output = None if verbose else subprocess.DEVNULL
+        times = []
+        for _ in range(cold_start_runs):
+            start = time.perf_counter()
+            process = subprocess.run([sys.executable, os.path.join(repo_dir, "aws-reports.py")] + args,
+                                     cwd=work_dir, env=env, stdout=output, stderr=output)
+            times.append(time.perf_counter() - start)
+            if process.returncode != 0:
+                return None
+        return sorted(times)[len(times) // 2]
+
+def main(argv=None):
+    parameters = process_cli_arguments(argv)
+    model=parameters[0]
+    select=parameters[1]
+    update=parameters[2]
+    verbose=parameters[3]
+
+    budgets = load_budgets()
+    check = budgets.get("model") == model
+    if not check and not update:
+        print ("Budgets in budgets.yaml were recorded with a different model, api calls are not checked")
+
+    print (f"Benchmark: {model['accounts']} accounts x {model['regions']} regions, {model['latency'] * 1000:.0f} ms per api call")
+    print (f"{'benchmark':32} {'seconds':>8} {'budget':>8} {'api calls':>10} {'budget':>8} {'peak MB':>8} {'budget':>8}  status")
+    failed = 0
+    measured = {}
+    for name, script, args in benchmarks:
+        if select not in name:
+            continue
+        results = [run_benchmark(script, args, model, verbose) for _ in range(update_runs if update else 1)]
+        result = None if None in results else results[0]
+        if result is None:
+            failed += 1
+            print (f"{name:32} {'-':>8} {'-':>8} {'-':>10} {'-':>8} {'-':>8} {'-':>8}  FAILED, script error (run with -v)")
+            continue
+        measured[name] = new_budget(results)
+        budget = get_budget(budgets, name) if check else {}
+        over = check_budget(result, budget)
+        status = "ok"
+        if over:
+            status = f"REGRESSION, {', '.join(over)} over budget"
+            failed += 1
+        print (f"{name:32} {result['seconds']:8.2f} {budget.get('seconds', '-'):>8} {result['calls']:10d} {budget.get('calls', '-'):>8} "
+               f"{result['peak_bytes'] / 2**20:8.1f} {budget.get('peak_mb', '-'):>8}  {status}")
+        if verbose:
+            for operation, count in result["operations"].items():
+                print (f"    {operation:40} {count:8d}")
+
+    started = False
+    for name, args, prime in cold_starts:
+        if select not in name:
+            continue
+        if not started:
+            print (f"\n{'cold start':32} {'ms':>8}")
+            started = True
+        seconds = measure_cold_start(args, prime, model, verbose)
+        if seconds is None:
+            failed += 1
+            print (f"{name:32} {'-':>8}  FAILED, script error (run with -v)")
+        else:
+            print (f"{name:32} {seconds * 1000:8.0f}")
+
+    if update:
+        if budgets.get("model") != model:
+            budgets = {"model": model, "budgets": {}}
+        budgets["budgets"].update(measured)
+        with open(budgets_file, "w") as f:
+            yaml.safe_dump(budgets, f, sort_keys=False)
+        print (f"Budgets of {len(measured)} benchmarks written to {budgets_file}")
+
+    if failed:
+        print (f"{failed} benchmarks failed")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,9 @@
+# Purpose: location of local caches (regions, credentials, inventory
+# snapshot, findings state, daemon socket), .cache next to the scripts.
+# AWS_REPORTS_CACHE=<dir> moves .cache elsewhere, e.g. for benchmark runs.
+
+import os
+
+def cache_path(*parts):
+    """Returns path of parts inside the cache directory."""
+    return os.path.join(os.environ.get("AWS_REPORTS_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")), *parts)
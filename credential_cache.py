@@ -0,0 +1,67 @@
+# Purpose: on-disk cache of temporary credentials, shared by all processes.
+#
+# Role (assume-role, web identity) and SSO profiles get credentials from
+# STS/SSO, which botocore keeps only in memory, so every script run asked
+# for them again. Their providers use this cache instead: one json file
+# per role/SSO account in .cache/credentials, reused by every run until
+# the credentials are within botocore's expiry window (15 minutes) of
+# expiring, then fetched and written again. Static keys are never written.
+# Files are 0600 in a 0700 directory and replaced atomically, so parallel
+# runs never read a partial file.
+
+import os, json, threading
+from cache_paths import cache_path
+
+cache_dir = cache_path("credentials")
+# botocore providers of temporary credentials that accept a cache
+cached_providers = ("assume-role", "assume-role-with-web-identity", "sso")
+
+class CredentialCache:
+    """Dict-like cache of botocore credential fetchers, keys are hashes of the role/SSO arguments."""
+    def __init__(self, path=cache_dir):
+        self.path = path
+
+    def cache_file(self, key):
+        return os.path.join(self.path, key.replace(os.sep, "_") + ".json")
+
+    def read(self, key):
+        try:
+            with open(self.cache_file(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def __contains__(self, key):
+        return self.read(key) is not None
+
+    def __getitem__(self, key):
+        value = self.read(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        # mode of makedirs applies only to a new directory
+        os.chmod(self.path, 0o700)
+        path = self.cache_file(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        # same for a temp file left by a crashed run
+        os.fchmod(fd, 0o600)
+        with os.fdopen(fd, "w") as f:
+            # Expiration is a datetime, botocore parses the iso string back
+            json.dump(value, f, default=lambda v: v.isoformat() if hasattr(v, "isoformat") else str(v))
+        os.replace(tmp_path, path)
+
+credential_cache = CredentialCache()
+
+def use_cache(core_session, cache=credential_cache):
+    """Makes temporary credential providers of the botocore session use the on-disk cache."""
+    import botocore.exceptions
+    resolver = core_session.get_component('credential_provider')
+    for name in cached_providers:
+        try:
+            resolver.get_provider(name).cache = cache
+        except botocore.exceptions.UnknownCredentialError:
+            pass
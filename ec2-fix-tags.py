@@ -5,15 +5,25 @@
 # Author Predrag Vlajkovic, 2024
 
 from __future__ import print_function
-import boto3, sys, getopt, yaml
-from uuid import uuid4
+import re, sys, getopt, yaml
+import botocore.exceptions
+from aws_clients import get_session, get_client
+from aws_retry import error_code
+from aws_paging import iterate
+from report_output import set_format, write_text, write_record
+from aws_fanout import run_units, default_max_workers
 
 global_cfg_ini_file="./config.yaml"
 global_config = []
 
+# create_tags takes up to 1000 resource ids per call
+max_batch = 1000
+# create_tags rejects the whole call when an instance was terminated since the scan
+not_found_code = 'InvalidInstanceID.NotFound'
+
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_ec2_tag(instance, tag_name, default="-"):
@@ -42,7 +52,6 @@ def is_tag_value_matching (instance, tag_value):
     return False
 
 def get_instances(session, ec2_name, region, status, instance_id):
-    instances = []
     filter_list = []
     if (status != "*"):
         filter_list.append ({'Name':'instance-state-name', 'Values':["*"+status+"*"]})
@@ -51,19 +60,15 @@ def get_instances(session, ec2_name, region, status, instance_id):
     if (instance_id != "*"):
         filter_list.append ({'Name':'instance-id', 'Values':[instance_id]})
 
-    ec2_client = session.client('ec2', region_name=region["RegionName"])
-    response=ec2_client.describe_instances(Filters=filter_list)
-    for ec2 in response['Reservations']:
-        for instance in ec2['Instances']:
-            if (instance):
-                instances.append (instance)
-    return instances
+    ec2_client = get_client(session, 'ec2', region_name=region["RegionName"])
+    for instance in iterate(ec2_client, 'describe_instances', 'Reservations[].Instances[]', Filters=filter_list):
+        yield instance
 
 # process command line arguments and return list of key pair values
 def process_cli_arguments (argv):
-    parameters = ["*", "*", "*", "*", "*", "*"]
+    parameters = ["*", "*", "*", "*", "*", "*", False, default_max_workers, "text"]
     try:
-        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:h",["region=","name=","status=","tag=","profile=","instance_id=","--help"])
+        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:dw:F:h",["region=","name=","status=","tag=","profile=","instance_id=","dry-run","workers=","format=","--help"])
     except getopt.GetoptError:
         print ("Invalid parameters, to see parameter map use:")
         print ("   ec2-search.py -h")
@@ -74,6 +79,9 @@ def process_cli_arguments (argv):
             print ("Usage: ec2-search.py --name <ec2_name> --region <region> --status <status> --tag <tag value> --profile <profile_name> --help")
             print ("   or: ec2-search.py -n <ec2_name> -r <region> -s <status> -t <tag value> -p <profile_name> -h")
             print ("   Assumed * for ec2_name, region and status, and default for profile_name if not specified")
+            print ("   --dry-run (-d) prints planned tag writes without changing anything")
+            print ("   --workers (-w) <n> number of parallel searches and tag writes, default " + str(default_max_workers))
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes mistagged instances as records, default text")
             sys.exit()
         elif opt in ("-n", "--name"):
             parameters[0]=arg
@@ -87,11 +95,73 @@ def process_cli_arguments (argv):
             parameters[4]=arg
         elif opt in ("-i", "--id"):
             parameters[5]=arg
+        elif opt in ("-d", "--dry-run"):
+            parameters[6]=True
+        elif opt in ("-w", "--workers"):
+            parameters[7]=int(arg)
+        elif opt in ("-F", "--format"):
+            parameters[8]=arg
         else:
             assert False, "unhandled option"
 
     return parameters
 
+def get_regions(session):
+    return get_client(session, 'ec2').describe_regions()['Regions']
+
+# find instances whose AvailabilityZone tag differs from real placement,
+# returns list of (profile, region, real_az, instance, tag_az)
+def find_fixes(sessions, ec2_name, region_name, status, instance_id, workers):
+    units = []
+    for unit, regions in run_units([(profile, "*") for profile in sessions], lambda unit: get_regions(sessions[unit[0]]), workers, ordered=True):
+        for region in regions:
+            if (region_name=="*" or region_name==region["RegionName"]):
+                units.append((unit[0], region["RegionName"]))
+
+    search = lambda unit: list(get_instances(sessions[unit[0]], ec2_name, {"RegionName": unit[1]}, status, instance_id))
+    fixes = []
+    for (profile, region), instances in run_units(units, search, workers, ordered=True):
+        for instance in instances:
+            tag_az = get_ec2_tag(instance,'AvailabilityZone')
+            if (tag_az != "-"):
+                real_az = instance['Placement']['AvailabilityZone']
+                if (real_az != tag_az):
+                    fixes.append((profile, region, real_az, instance, tag_az))
+    return fixes
+
+# group fixes by (profile, region, tag value) into create_tags calls of up to max_batch instances
+def plan_batches(fixes):
+    groups = {}
+    for profile, region, real_az, instance, tag_az in fixes:
+        groups.setdefault((profile, region, real_az), []).append(instance['InstanceId'])
+    return [(profile, region, real_az, ids[i:i+max_batch])
+            for (profile, region, real_az), ids in groups.items()
+            for i in range(0, len(ids), max_batch)]
+
+def write_batch(sessions, batch):
+    """
+    Tags instances of the batch, returns (tagged, gone, error). Instances
+    named in InvalidInstanceID.NotFound are left out (gone) and the call is
+    repeated, error is the message of any other failure.
+    """
+    profile, region, real_az, instance_ids = batch
+    gone = []
+    while instance_ids:
+        try:
+            ec2_client = get_client(sessions[profile], 'ec2', region_name=region)
+            # RequestLimitExceeded is rate limited and retried by the client, see aws_retry.py
+            ec2_client.create_tags(Resources=instance_ids, Tags=[{ 'Key':'AvailabilityZone', 'Value': real_az }])
+            return len(instance_ids), gone, None
+        except botocore.exceptions.ClientError as e:
+            missing = set(re.findall(r"i-[\w-]+", str(e))) & set(instance_ids) if error_code(e) == not_found_code else set()
+            if not missing:
+                return 0, gone, str(e)
+            gone += sorted(missing)
+            instance_ids = [instance_id for instance_id in instance_ids if instance_id not in missing]
+        except botocore.exceptions.BotoCoreError as e:
+            return 0, gone, str(e)
+    return 0, gone, None
+
 def main(argv=None):
     global_config = parse_config_file()
     parameters = process_cli_arguments(argv)
@@ -101,28 +171,47 @@ def main(argv=None):
     tag_value=parameters[3]
     profile_name=parameters[4]
     instance_id=parameters[5]
+    dry_run=parameters[6]
+    workers=parameters[7]
+    set_format(parameters[8])
+
+    write_text (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
+    sessions = {profile: get_session(profile) for profile in global_config['profiles'] if (profile_name == "*" or profile == profile_name)}
+    fixes = find_fixes(sessions, ec2_name, region_name, status, instance_id, workers)
+    for count, (profile, region, real_az, instance, tag_az) in enumerate(fixes, 1):
+        record = {'profile': profile, 'region': region, 'id': instance['InstanceId'], 'name': get_ec2_tag(instance,'Name'), 'real_az': real_az, 'tag_az': tag_az}
+        write_record (record, f" #{count:3d};  profile: {profile} instance_name: {record['name']};    real_az: {real_az};   tag_az: {tag_az};")
+
+    if not fixes:
+        write_text ("Sorry, no instances found, maybe filter is not good")
+        write_text (" ")
+        return
+    write_text (f"Total {len(fixes)} instances found")
+
+    batches = plan_batches(fixes)
+    if dry_run:
+        write_text (f"Dry run, planned {len(batches)} create_tags calls:")
+        for count, (profile, region, real_az, instance_ids) in enumerate(batches, 1):
+            write_text (f" #{count:3d};  profile: {profile};  region: {region};  AvailabilityZone={real_az};  instances: {len(instance_ids)} ({', '.join(instance_ids)})")
+        write_text (" ")
+        return
 
-    count = 0
-    print (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
-    for profile in global_config['profiles']:
-        if (profile_name == "*" or profile == profile_name):
-            session = boto3.Session(profile_name=profile)
-            for region in session.client('ec2').describe_regions()['Regions']:
-                if (region_name=="*" or region_name==region["RegionName"]):
-                    instances = get_instances(session, ec2_name, region, status, instance_id)
-                    for instance in instances:
-                        tag_az = get_ec2_tag(instance,'AvailabilityZone')
-                        if (tag_az != "-"):
-                            real_az = instance['Placement']['AvailabilityZone']
-                            if (real_az != tag_az):
-                                count += 1
-                                print (f" #{count:3d};  profile: {profile} instance_name: {get_ec2_tag(instance,'Name')};    real_az: {real_az};   tag_az: {tag_az};")
-                                response = session.client('ec2').create_tags(Resources=[instance['InstanceId']], Tags=[{ 'Key':'AvailabilityZone', 'Value': real_az }] )
-    if (count > 0):
-        print (f"Total {count} instances found")
-    else:
-        print ("Sorry, no instances found, maybe filter is not good")
-    print (" ")
+    tagged = 0
+    gone = []
+    failed = []
+    for batch, (written, batch_gone, error) in run_units(batches, lambda batch: write_batch(sessions, batch), workers):
+        tagged += written
+        gone += batch_gone
+        if error:
+            failed.append((batch, error))
+    write_text (f"Tagged {tagged} instances with {len(batches)} create_tags calls")
+    if gone:
+        write_text (f"Skipped {len(gone)} instances terminated since the search: {', '.join(gone)}")
+    for (profile, region, real_az, instance_ids), error in failed:
+        print (f"Failed to tag {len(instance_ids)} instances in profile {profile}, region {region} with AvailabilityZone={real_az} ({', '.join(instance_ids)}): {error}", file=sys.stderr)
+    write_text (" ")
+    if failed:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
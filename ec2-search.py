@@ -5,15 +5,21 @@
 # Author Predrag Vlajkovic, 2019-2024
 
 from __future__ import print_function
-import boto3, sys, getopt, yaml
-from uuid import uuid4
+import sys, getopt, yaml
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from aws_fanout import run_units, default_max_workers
+from inventory_store import open_store, get_or_fetch, snapshot_key, default_ttl
+from ec2_index import get_index, search_index
+from itertools import groupby
+from report_output import set_format, write_text, write_record
 
 global_cfg_ini_file="config.yaml"
 global_config = []
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_ec2_tag(instance, tag_name, default="-"):
@@ -35,7 +41,6 @@ def is_tag_value_matching (instance, tag_value):
     return False
 
 def get_instances(session, ec2_name, region, status, instance_id):
-    instances = []
     filter_list = []
     if (status != "*"):
         filter_list.append ({'Name':'instance-state-name', 'Values':["*"+status+"*"]})
@@ -44,19 +49,19 @@ def get_instances(session, ec2_name, region, status, instance_id):
     if (instance_id != "*"):
         filter_list.append ({'Name':'instance-id', 'Values':[instance_id]})
 
-    ec2_client = session.client('ec2', region_name=region["RegionName"])
-    response=ec2_client.describe_instances(Filters=filter_list)
-    for ec2 in response['Reservations']:
-        for instance in ec2['Instances']:
-            if (instance):
-                instances.append (instance)
-    return instances
+    ec2_client = get_client(session, 'ec2', region_name=region["RegionName"])
+    for instance in iterate(ec2_client, 'describe_instances', 'Reservations[].Instances[]', Filters=filter_list):
+        yield instance
+
+def get_regions(session):
+    ec2_client = get_client(session, 'ec2')
+    return ec2_client.describe_regions()['Regions']
 
 # process command line arguments and return list of key pair values
 def process_cli_arguments (argv):
-    parameters = ["*", "*", "*", "*", "*", "*"]
+    parameters = ["*", "*", "*", "*", "*", "*", False, default_max_workers, False, "text"]
     try:
-        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:h",["region=","name=","status=","tag=","profile=","instance_id=","--help"])
+        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:w:ocF:h",["region=","name=","status=","tag=","profile=","instance_id=","workers=","ordered","cached","format=","--help"])
     except getopt.GetoptError:
         print ("Invalid parameters, to see parameter map use:")
         print ("   ec2-search.py -h")
@@ -67,6 +72,9 @@ def process_cli_arguments (argv):
             print ("Usage: ec2-search.py --name <ec2_name> --region <region> --status <status> --tag <tag value> --profile <profile_name> --help")
             print ("   or: ec2-search.py -n <ec2_name> -r <region> -s <status> -t <tag value> -p <profile_name> -h")
             print ("   Assumed * for ec2_name, region and status, and default for profile_name if not specified")
+            print ("   --ordered (-o) prints instances in profile/region order, --workers (-w) sets number of parallel api calls")
+            print ("   --cached (-c) searches local inventory snapshot, refreshed when older than inventory_ttl (see inventory-refresh.py)")
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes instances as records while searching, default text")
             sys.exit()
         elif opt in ("-n", "--name"):
             parameters[0]=arg
@@ -80,11 +88,51 @@ def process_cli_arguments (argv):
             parameters[4]=arg
         elif opt in ("-i", "--id"):
             parameters[5]=arg
+        elif opt in ("-o", "--ordered"):
+            parameters[6]=True
+        elif opt in ("-w", "--workers"):
+            parameters[7]=int(arg)
+        elif opt in ("-c", "--cached"):
+            parameters[8]=True
+        elif opt in ("-F", "--format"):
+            parameters[9]=arg
         else:
             assert False, "unhandled option"
 
     return parameters
 
+# first list regions of every profile, then search every (profile, region) pair in parallel,
+# yields ((profile, region name), instances with a tag value matching tag_value)
+def search_live(sessions, region_name, ec2_name, status, instance_id, tag_value, workers, ordered):
+    units = []
+    profile_units = [(profile,) for profile in sessions]
+    for unit, regions in run_units(profile_units, lambda unit: get_regions(sessions[unit[0]]), workers, ordered=True):
+        for region in regions:
+            if (region_name=="*" or region_name==region["RegionName"]):
+                units.append((unit[0], region["RegionName"]))
+
+    # tag values are not an api filter, they are matched here
+    search = lambda unit: [instance for instance in get_instances(sessions[unit[0]], ec2_name, {"RegionName": unit[1]}, status, instance_id)
+                           if is_tag_value_matching(instance, tag_value)]
+    return run_units(units, search, workers, ordered=ordered)
+
+# same as search_live, but on inventory snapshot, only missing or expired snapshots are fetched,
+# name, status, id and tag value are matched with trigram index (case insensitive),
+# sessions are created only when a snapshot has to be fetched
+def search_snapshot(profiles, region_name, ec2_name, status, instance_id, tag_value, workers, ttl):
+    store = open_store()
+    regions = get_or_fetch(store, [(profile, "*") for profile in profiles], 'region',
+                           lambda unit: get_regions(get_session(unit[0])), ttl, workers)
+    units = [(profile, region["RegionName"]) for (profile, _), profile_regions in regions.items()
+             for region in profile_regions if (region_name=="*" or region_name==region["RegionName"])]
+    inventory = get_or_fetch(store, units, 'ec2',
+                             lambda unit: get_instances(get_session(unit[0]), "*", {"RegionName": unit[1]}, "*", "*"), ttl, workers)
+    # the index is rebuilt only when a snapshot changed (reused by reports-daemon.py)
+    index = get_index(snapshot_key(store, units, 'ec2'), lambda: ((unit, instance) for unit in units for instance in inventory[unit]))
+    found = search_index(index, name=ec2_name, state=status, id=instance_id, tag=tag_value)
+    for unit, items in groupby(found, key=lambda item: item[0]):
+        yield unit, [instance for _, instance in items if (instance_id == "*" or instance_id == instance['InstanceId'])]
+
 def main(argv=None):
     global_config = parse_config_file()
     parameters = process_cli_arguments(argv)
@@ -94,24 +142,30 @@ def main(argv=None):
     tag_value=parameters[3]
     profile_name=parameters[4]
     instance_id=parameters[5]
+    ordered=parameters[6]
+    workers=parameters[7]
+    cached=parameters[8]
+    set_format(parameters[9])
 
     count = 0
-    print (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
-    for profile in global_config['profiles']:
-        if (profile_name == "*" or profile == profile_name):
-            session = boto3.Session(profile_name=profile)
-            for region in session.client('ec2').describe_regions()['Regions']:
-                if (region_name=="*" or region_name==region["RegionName"]):
-                    instances = get_instances(session, ec2_name, region, status, instance_id)
-                    for instance in instances:
-                        if (is_tag_value_matching (instance, tag_value)):
-                            count += 1
-                            print (f" #{count:3d};  name: {get_ec2_tag(instance,'Name')};  profile: {profile};  region: {region['RegionName']};  id: {instance['InstanceId']};  status: {instance['State']['Name']}")
+    write_text (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
+    profiles = [profile for profile in global_config['profiles'] if (profile_name == "*" or profile == profile_name)]
+
+    if cached:
+        results = search_snapshot(profiles, region_name, ec2_name, status, instance_id, tag_value, workers, global_config.get('inventory_ttl', default_ttl))
+    else:
+        sessions = {profile: get_session(profile) for profile in profiles}
+        results = search_live(sessions, region_name, ec2_name, status, instance_id, tag_value, workers, ordered)
+    for (profile, region), instances in results:
+        for instance in instances:
+            count += 1
+            record = {'name': get_ec2_tag(instance,'Name'), 'profile': profile, 'region': region, 'id': instance['InstanceId'], 'status': instance['State']['Name']}
+            write_record (record, f" #{count:3d};  name: {record['name']};  profile: {profile};  region: {region};  id: {record['id']};  status: {record['status']}")
     if (count > 0):
-        print (f"Total {count} instances found")
+        write_text (f"Total {count} instances found")
     else:
-        print ("Sorry, no instances found, maybe filter is not good")
-    print (" ")
+        write_text ("Sorry, no instances found, maybe filter is not good")
+    write_text (" ")
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -5,15 +5,18 @@
 # Author Predrag Vlajkovic, 2024
 
 from __future__ import print_function
-import boto3, sys, getopt, yaml
-from uuid import uuid4
+import sys, getopt, yaml
+import botocore.exceptions
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from report_output import set_format, write_text, write_record
 
 global_cfg_ini_file="config.yaml"
 global_config = []
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_ec2_tag(instance, tag_name, default="-"):
@@ -24,20 +27,41 @@ def get_ec2_tag(instance, tag_name, default="-"):
                 tag_value = tag["Value"]
     return tag_value
 
-# def get_ec2_volumes(session, instance_name, region):
-def get_ec2_volumes(session, instance, region):
-    ec2_client = session.client('ec2', region_name=region["RegionName"])
-    volumes = instance["BlockDeviceMappings"]
-    if (volumes):
-        for v in volumes:
-            response = ec2_client.describe_volumes(
-                VolumeIds=[
-                    v["Ebs"]["VolumeId"],
-                ],
-            )
-            if (response):
-                for r in response["Volumes"]:
-                    print("     ",r["VolumeId"], r["Size"])
+# volume ids per describe_volumes call, above sweep_threshold ids the whole
+# region is listed page by page instead
+volume_batch_size = 200
+volume_sweep_threshold = 1000
+
+def get_volume_ids(instance):
+    return [v["Ebs"]["VolumeId"] for v in instance.get("BlockDeviceMappings", []) if "Ebs" in v]
+
+def sweep_volumes(ec2_client):
+    volumes = {}
+    for volume in iterate(ec2_client, 'describe_volumes', 'Volumes', PaginationConfig={'PageSize': 500}):
+        volumes[volume["VolumeId"]] = volume
+    return volumes
+
+# resolve volume ids of one region in batches, returns VolumeId -> volume dict
+def get_volumes_index(session, region, volume_ids):
+    ec2_client = get_client(session, 'ec2', region_name=region["RegionName"])
+    volume_ids = sorted(set(volume_ids))
+    if len(volume_ids) > volume_sweep_threshold:
+        return sweep_volumes(ec2_client)
+    volumes = {}
+    try:
+        for i in range(0, len(volume_ids), volume_batch_size):
+            response = ec2_client.describe_volumes(VolumeIds=volume_ids[i:i+volume_batch_size])
+            for volume in response["Volumes"]:
+                volumes[volume["VolumeId"]] = volume
+    except botocore.exceptions.ClientError as e:
+        # a volume was deleted meanwhile, whole batch is rejected, list region instead
+        if e.response['Error']['Code'] != "InvalidVolume.NotFound":
+            raise
+        return sweep_volumes(ec2_client)
+    return volumes
+
+def get_ec2_volumes(instance, volumes):
+    return [{'id': volume_id, 'size': volumes[volume_id]["Size"]} for volume_id in get_volume_ids(instance) if volume_id in volumes]
 
 def is_tag_value_matching (instance, tag_value):
     if (tag_value == "*"):
@@ -49,7 +73,6 @@ def is_tag_value_matching (instance, tag_value):
     return False
 
 def get_instances(session, ec2_name, region, status, instance_id):
-    instances = []
     filter_list = []
     if (status != "*"):
         filter_list.append ({'Name':'instance-state-name', 'Values':["*"+status+"*"]})
@@ -58,19 +81,15 @@ def get_instances(session, ec2_name, region, status, instance_id):
     if (instance_id != "*"):
         filter_list.append ({'Name':'instance-id', 'Values':[instance_id]})
 
-    ec2_client = session.client('ec2', region_name=region["RegionName"])
-    response=ec2_client.describe_instances(Filters=filter_list)
-    for ec2 in response['Reservations']:
-        for instance in ec2['Instances']:
-            if (instance):
-                instances.append (instance)
-    return instances
+    ec2_client = get_client(session, 'ec2', region_name=region["RegionName"])
+    for instance in iterate(ec2_client, 'describe_instances', 'Reservations[].Instances[]', Filters=filter_list):
+        yield instance
 
 # process command line arguments and return list of key pair values
 def process_cli_arguments (argv):
-    parameters = ["*", "*", "*", "*", "*", "*"]
+    parameters = ["*", "*", "*", "*", "*", "*", "text"]
     try:
-        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:h",["region=","name=","status=","tag=","profile=","instance_id=","--help"])
+        opts, args = getopt.getopt(argv,"a:r:n:s:t:p:i:F:h",["region=","name=","status=","tag=","profile=","instance_id=","format=","--help"])
     except getopt.GetoptError:
         print ("Invalid parameters, to see parameter map use:")
         print ("   ec2-search.py -h")
@@ -81,6 +100,7 @@ def process_cli_arguments (argv):
             print ("Usage: ec2-search.py --name <ec2_name> --region <region> --status <status> --tag <tag value> --profile <profile_name> --help")
             print ("   or: ec2-search.py -n <ec2_name> -r <region> -s <status> -t <tag value> -p <profile_name> -h")
             print ("   Assumed * for ec2_name, region and status, and default for profile_name if not specified")
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes instances with their volumes as records, default text")
             sys.exit()
         elif opt in ("-n", "--name"):
             parameters[0]=arg
@@ -94,6 +114,8 @@ def process_cli_arguments (argv):
             parameters[4]=arg
         elif opt in ("-i", "--id"):
             parameters[5]=arg
+        elif opt in ("-F", "--format"):
+            parameters[6]=arg
         else:
             assert False, "unhandled option"
 
@@ -108,24 +130,31 @@ def main(argv=None):
     tag_value=parameters[3]
     profile_name=parameters[4]
     instance_id=parameters[5]
+    set_format(parameters[6])
 
     count = 0
-    print (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
+    write_text (f"Searching for ec2 instances named like {ec2_name}, in aws account/profile {profile_name}, in region {region_name}, with tag value {tag_value}, with status {status}!")
     for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        for region in session.client('ec2').describe_regions()['Regions']:
+        session = get_session(profile)
+        for region in get_client(session, 'ec2').describe_regions()['Regions']:
             if (region_name=="*" or region_name==region["RegionName"]):
                 instances = get_instances(session, ec2_name, region, status, instance_id)
+                # volumes are resolved per region in batches, so matching instances of a region are kept
+                instances = [instance for instance in instances if is_tag_value_matching (instance, tag_value)]
+                volume_ids = [volume_id for instance in instances for volume_id in get_volume_ids(instance)]
+                volumes = get_volumes_index(session, region, volume_ids) if volume_ids else {}
                 for instance in instances:
-                    if (is_tag_value_matching (instance, tag_value)):
-                        count += 1
-                        print (f" #{count:3d};  name: {get_ec2_tag(instance,'Name')};  profile: {profile};  region: {region['RegionName']};  id: {instance['InstanceId']};  status: {instance['State']['Name']}")
-                        get_ec2_volumes(session, instance, region)
+                    count += 1
+                    record = {'name': get_ec2_tag(instance,'Name'), 'profile': profile, 'region': region['RegionName'], 'id': instance['InstanceId'],
+                              'status': instance['State']['Name'], 'volumes': get_ec2_volumes(instance, volumes)}
+                    lines = [f" #{count:3d};  name: {record['name']};  profile: {profile};  region: {record['region']};  id: {record['id']};  status: {record['status']}"]
+                    lines += [f"      {volume['id']} {volume['size']}" for volume in record['volumes']]
+                    write_record (record, "\n".join(lines))
     if (count > 0):
-        print (f"Total {count} instances found")
+        write_text (f"Total {count} instances found")
     else:
-        print ("Sorry, no instances found, maybe filter is not good")
-    print (" ")
+        write_text ("Sorry, no instances found, maybe filter is not good")
+    write_text (" ")
 
 if __name__ == '__main__':
     main(sys.argv[1:])
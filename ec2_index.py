@@ -0,0 +1,81 @@
+# Purpose: in-memory trigram index over fetched ec2 instances, for
+# substring search by tag value, name, instance id and state.
+#
+# Every searchable value is lowercased once, when the index is built.
+# A substring query intersects posting lists of the query's trigrams and
+# verifies only the candidates, so its cost follows the number of matches
+# rather than number of instances times number of tags.
+
+fields = ("tag", "name", "id", "state")
+
+def trigrams(text):
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+def get_field_values(instance):
+    tags = instance.get("Tags", [])
+    return {
+        "tag": [tag["Value"].lower() for tag in tags],
+        "name": [tag["Value"].lower() for tag in tags if tag["Key"].lower() == "name"][-1:],
+        "id": [instance["InstanceId"].lower()],
+        "state": [instance["State"]["Name"].lower()],
+    }
+
+def build_index(items):
+    """
+    Builds index over (key, instance) pairs, key is anything the caller
+    needs back with the instance, e.g. its (profile, region).
+    """
+    index = {"items": list(items), "values": {f: [] for f in fields}, "postings": {f: {} for f in fields}}
+    for position, (key, instance) in enumerate(index["items"]):
+        for field, values in get_field_values(instance).items():
+            index["values"][field].append(values)
+            postings = index["postings"][field]
+            for value in values:
+                for gram in trigrams(value):
+                    posting = postings.setdefault(gram, [])
+                    if not posting or posting[-1] != position:
+                        posting.append(position)
+    return index
+
+# last built index and its key, reused by long running processes
+# (reports-daemon.py) while the key, e.g. snapshot times, is unchanged
+last_index = (None, None)
+
+def get_index(key, items):
+    """Returns index of items (callable returning (key, instance) pairs), built only when key changed."""
+    global last_index
+    if last_index[0] != key:
+        last_index = (key, build_index(items()))
+    return last_index[1]
+
+def get_positions(index, field, query):
+    query = query.lower()
+    grams = trigrams(query)
+    if grams:
+        lists = sorted((index["postings"][field].get(gram, []) for gram in grams), key=len)
+        candidates = set(lists[0])
+        for posting in lists[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+    else:
+        # queries shorter than a trigram can not use postings
+        candidates = range(len(index["items"]))
+    values = index["values"][field]
+    return {p for p in candidates if any(query in value for value in values[p])}
+
+def search_index(index, **queries):
+    """
+    Returns (key, instance) pairs, in build order, whose fields contain all
+    given substrings (case insensitive), e.g. search_index(index, tag="prod", name="web").
+    "*" matches everything.
+    """
+    matching = None
+    for field, query in queries.items():
+        if query == "*":
+            continue
+        found = get_positions(index, field, query)
+        matching = found if matching is None else matching & found
+    if matching is None:
+        return list(index["items"])
+    return [index["items"][p] for p in sorted(matching)]
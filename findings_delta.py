@@ -0,0 +1,83 @@
+# Purpose: delta mode for recurring reports.
+#
+# Each run's findings are stored per resource in .cache/findings/<report>.json
+# together with a fingerprint of the resource configuration they were
+# evaluated from. A resource with an unchanged fingerprint is not
+# re-evaluated, its previous findings are reused. Comparing the stored and
+# the current run gives new, resolved and changed findings.
+#
+# A finding is a dict with a stable 'id' (what it is about, e.g. profile,
+# security group and ports) and any other fields (its current content).
+
+import os, json, hashlib
+from report_output import write_text, write_record
+from cache_paths import cache_path
+
+state_dir = cache_path("findings")
+
+def fingerprint(data):
+    """Stable content hash of any json serializable data."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def state_file(report):
+    return os.path.join(state_dir, f"{report}.json")
+
+def load_state(report):
+    try:
+        with open(state_file(report)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(report, state):
+    os.makedirs(state_dir, exist_ok=True)
+    path = state_file(report)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, default=str)
+    os.replace(tmp_path, path)
+
+def evaluate(old_state, new_state, resource_key, config, evaluate_fn):
+    """
+    Returns findings of a resource: evaluate_fn() when config changed since
+    the previous run, otherwise the previous findings. Records the result
+    in new_state.
+    """
+    config_fingerprint = fingerprint(config)
+    previous = old_state.get(resource_key)
+    if previous and previous["fingerprint"] == config_fingerprint:
+        findings = previous["findings"]
+    else:
+        # json round trip, so fresh and reused findings compare equal
+        findings = json.loads(json.dumps(evaluate_fn(), default=str))
+    new_state[resource_key] = {"fingerprint": config_fingerprint, "findings": findings}
+    return findings
+
+def get_findings(state):
+    return {finding["id"]: finding for resource in state.values() for finding in resource["findings"]}
+
+def diff(old_state, new_state):
+    """Returns (new, resolved, changed) findings, changed as (old, new) pairs."""
+    old_findings = get_findings(old_state)
+    new_findings = get_findings(new_state)
+    new = [f for i, f in new_findings.items() if i not in old_findings]
+    resolved = [f for i, f in old_findings.items() if i not in new_findings]
+    changed = [(old_findings[i], f) for i, f in new_findings.items()
+               if i in old_findings and fingerprint(old_findings[i]) != fingerprint(f)]
+    return new, resolved, changed
+
+def print_delta(old_state, new_state, format_finding):
+    """
+    Prints new, resolved and changed findings, format_finding(finding) returns the report line.
+    In jsonl/csv output each finding is a record with 'change' set to new, resolved or changed.
+    """
+    new, resolved, changed = diff(old_state, new_state)
+    for title, findings in (("New", new), ("Resolved", resolved)):
+        write_text(f"{title} findings: {len(findings)}")
+        for count, finding in enumerate(findings, 1):
+            write_record(dict(finding, change=title.lower()), f"{count:4} - {format_finding(finding)}")
+        write_text("")
+    write_text(f"Changed findings: {len(changed)}")
+    for count, (old, finding) in enumerate(changed, 1):
+        write_record(dict(finding, change="changed"), f"{count:4} - was: {format_finding(old)}\n       now: {format_finding(finding)}")
+    write_text("")
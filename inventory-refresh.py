@@ -0,0 +1,78 @@
+# Purpose: refresh local inventory snapshot (.cache/inventory.sqlite)
+# used by ec2-search.py --cached, for all or one aws account/profile and region.
+# Only ec2 instances are kept in the snapshot, the reports (e.g.
+# vpc-empty-report.py, sg-unrestricted-access-report.py) still call aws live.
+#
+# Author Predrag Vlajkovic, 2024
+
+from __future__ import print_function
+import sys, getopt, time, yaml
+from aws_clients import get_session, get_client
+from aws_fanout import default_max_workers
+from inventory_store import open_store, get_or_fetch
+from aws_paging import iterate
+
+global_cfg_ini_file="config.yaml"
+global_config = []
+
+def parse_config_file():
+    with open(global_cfg_ini_file) as f:
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    return config
+
+def get_regions(session):
+    return get_client(session, 'ec2').describe_regions()['Regions']
+
+def get_instances(session, region_name):
+    ec2_client = get_client(session, 'ec2', region_name=region_name)
+    return iterate(ec2_client, 'describe_instances', 'Reservations[].Instances[]')
+
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = ["*", "*", default_max_workers]
+    try:
+        opts, args = getopt.getopt(argv,"r:p:w:h",["region=","profile=","workers=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   inventory-refresh.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: inventory-refresh.py --region <region> --profile <profile_name> --workers <workers> --help")
+            print ("   or: inventory-refresh.py -r <region> -p <profile_name> -w <workers> -h")
+            print ("   Assumed * for region and profile_name if not specified")
+            print ("   Refreshes ec2 instances read by ec2-search.py --cached, reports do not read the snapshot")
+            sys.exit()
+        elif opt in ("-r", "--region"):
+            parameters[0]=arg
+        elif opt in ("-p", "--profile"):
+            parameters[1]=arg
+        elif opt in ("-w", "--workers"):
+            parameters[2]=int(arg)
+        else:
+            assert False, "unhandled option"
+
+    return parameters
+
+def main(argv=None):
+    global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    region_name=parameters[0]
+    profile_name=parameters[1]
+    workers=parameters[2]
+
+    start = time.time()
+    store = open_store()
+    sessions = {profile: get_session(profile) for profile in global_config['profiles'] if (profile_name == "*" or profile == profile_name)}
+    regions = get_or_fetch(store, [(profile, "*") for profile in sessions], 'region',
+                           lambda unit: get_regions(sessions[unit[0]]), 0, workers)
+    units = [(profile, region["RegionName"]) for (profile, _), profile_regions in regions.items()
+             for region in profile_regions if (region_name=="*" or region_name==region["RegionName"])]
+    inventory = get_or_fetch(store, units, 'ec2', lambda unit: get_instances(sessions[unit[0]], unit[1]), 0, workers)
+
+    total = sum(len(instances) for instances in inventory.values())
+    print (f"Refreshed {total} ec2 instances in {len(units)} profile/region pairs in {time.time()-start:.1f}s")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
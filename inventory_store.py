@@ -0,0 +1,130 @@
+# Purpose: local sqlite snapshot of describe_* results per profile and region.
+#
+# Snapshots are normalized to one row per resource (json document) and are
+# fresh for ttl seconds. ec2-search.py --cached (ec2 instances) and the
+# route53 searches read fresh snapshots in milliseconds and fetch live only
+# what is missing or expired, the reports do not use snapshots and always
+# call aws; inventory-refresh.py re-fetches ec2 snapshots explicitly.
+# Queries answered by reports-daemon.py run in snapshots_only(), they use
+# the latest snapshot whatever its age and never call aws.
+
+import os, json, math, time, sqlite3, threading
+from contextlib import contextmanager
+from aws_fanout import run_units, default_max_workers
+from cache_paths import cache_path
+
+store_file = cache_path("inventory.sqlite")
+default_ttl = 3600
+# decoded snapshots, reused while their fetched_at is unchanged, which
+# keeps the inventory in memory in long running processes (reports-daemon.py)
+loaded = {}
+# snapshots_only() flag of the current thread
+query_state = threading.local()
+
+schema = """
+create table if not exists snapshots (
+    profile text, region text, kind text, fetched_at real,
+    primary key (profile, region, kind));
+create table if not exists resources (
+    profile text, region text, kind text, position integer, data text,
+    primary key (profile, region, kind, position));
+"""
+
+def open_store(path=store_file):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    return conn
+
+class SnapshotMissing(Exception):
+    """Raised by get_or_fetch within snapshots_only() for a unit without snapshot."""
+
+@contextmanager
+def snapshots_only():
+    """
+    Within it get_or_fetch of this thread never fetches: snapshots of any
+    age are used and a unit without one raises SnapshotMissing.
+    """
+    query_state.snapshots_only = True
+    try:
+        yield
+    finally:
+        query_state.snapshots_only = False
+
+def save(conn, profile, region, kind, items):
+    """Replaces snapshot of kind (e.g. 'ec2') for profile and region, items is a list."""
+    with conn:
+        conn.execute("delete from resources where profile=? and region=? and kind=?", (profile, region, kind))
+        conn.executemany("insert into resources values (?, ?, ?, ?, ?)",
+                         ((profile, region, kind, i, json.dumps(item, default=str)) for i, item in enumerate(items)))
+        fetched_at = time.time()
+        conn.execute("insert or replace into snapshots values (?, ?, ?, ?)", (profile, region, kind, fetched_at))
+    loaded[(profile, region, kind)] = (fetched_at, items)
+
+def get_fetched_at(conn, profile, region, kind):
+    row = conn.execute("select fetched_at from snapshots where profile=? and region=? and kind=?",
+                       (profile, region, kind)).fetchone()
+    return row[0] if row else None
+
+def snapshot_key(conn, units, kind):
+    """Key of the units' snapshots, changes when any of them is saved again (e.g. for ec2_index.get_index)."""
+    return (tuple(units), tuple(get_fetched_at(conn, unit[0], unit[1], kind) for unit in units))
+
+def load(conn, profile, region, kind, ttl=default_ttl):
+    """
+    Returns items of the snapshot, or None when it is missing or older than ttl.
+    Items are shared between calls, callers must not modify them.
+    """
+    fetched_at = get_fetched_at(conn, profile, region, kind)
+    if fetched_at is None or time.time() - fetched_at > ttl:
+        return None
+    cached = loaded.get((profile, region, kind))
+    if cached and cached[0] == fetched_at:
+        return cached[1]
+    rows = conn.execute("select data from resources where profile=? and region=? and kind=? order by position",
+                        (profile, region, kind))
+    items = [json.loads(data) for (data,) in rows]
+    loaded[(profile, region, kind)] = (fetched_at, items)
+    return items
+
+def get_or_fetch(conn, units, kind, fetch, ttl=default_ttl, max_workers=default_max_workers, errors=None):
+    """
+    Returns {unit: items} for (profile, region) units, in the order of units.
+    Units without a fresh snapshot are fetched in parallel with fetch(unit)
+    and saved, ttl=0 fetches all of them. A failed fetch is raised, or with
+    an errors list appended to it as (kind, unit, exception), then the unit
+    keeps its snapshot of any age, or is left out when it has none.
+    """
+    units = list(units)
+    only_snapshots = getattr(query_state, "snapshots_only", False)
+    if only_snapshots:
+        ttl = math.inf
+    items = {}
+    for unit in units:
+        cached = load(conn, unit[0], unit[1], kind, ttl) if ttl > 0 else None
+        if cached is not None:
+            items[unit] = cached
+    missing = [unit for unit in units if unit not in items]
+    if missing and only_snapshots:
+        raise SnapshotMissing(f"no {kind} snapshot of {missing[0][0]} {missing[0][1]}")
+
+    def fetch_unit(unit):
+        try:
+            return list(fetch(unit))
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append((kind, unit, e))
+            return None
+
+    for unit, fetched in run_units(missing, fetch_unit, max_workers):
+        if fetched is None:
+            cached = load(conn, unit[0], unit[1], kind, math.inf)
+            if cached is not None:
+                items[unit] = cached
+            continue
+        # round trip through json, so live and cached items look the same
+        fetched = json.loads(json.dumps(fetched, default=str))
+        save(conn, unit[0], unit[1], kind, fetched)
+        items[unit] = fetched
+    return {unit: items[unit] for unit in units if unit in items}
@@ -0,0 +1,85 @@
+# Purpose: in all aws accounts/profiles find route53 records that point at
+# given values (ip address, elb dns name, cloudfront domain, cname target).
+# Values can be given on command line or read from a file, one per line.
+#
+# Author Predrag Vlajkovic, 2024
+
+from __future__ import print_function
+import sys, getopt, yaml
+from inventory_store import open_store, default_ttl
+from r53_index import load_records, build_value_index, lookup_values
+from report_output import set_format, write_text, write_record
+
+global_cfg_ini_file="config.yaml"
+global_config = []
+
+def parse_config_file():
+    with open(global_cfg_ini_file) as f:
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    return config
+
+def read_values(file_name):
+    with (sys.stdin if file_name == "-" else open(file_name)) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = [[], "*", False, "text"]
+    try:
+        opts, args = getopt.getopt(argv,"v:i:p:fF:h",["value=","input=","profile=","refresh","format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   r53-reverse-search.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: r53-reverse-search.py --value <value> --input <file> --profile <profile_name> --refresh --help")
+            print ("   or: r53-reverse-search.py -v <value> -i <file> -p <profile_name> -f -h")
+            print ("   --value can be repeated, --input reads values from file (- for stdin), one per line")
+            print ("   --refresh (-f) re-reads records from route53 instead of local snapshot")
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes found records, with the value they point at, default text")
+            sys.exit()
+        elif opt in ("-v", "--value"):
+            parameters[0].append(arg)
+        elif opt in ("-i", "--input"):
+            parameters[0].extend(read_values(arg))
+        elif opt in ("-p", "--profile"):
+            parameters[1]=arg
+        elif opt in ("-f", "--refresh"):
+            parameters[2]=True
+        elif opt in ("-F", "--format"):
+            parameters[3]=arg
+        else:
+            assert False, "unhandled option"
+
+    return parameters
+
+def main(argv=None):
+    global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    values=parameters[0]
+    profile_name=parameters[1]
+    refresh=parameters[2]
+    set_format(parameters[3])
+
+    profiles = [profile for profile in global_config['profiles'] if (profile_name == "*" or profile == profile_name)]
+    ttl = 0 if refresh else global_config.get('inventory_ttl', default_ttl)
+    index = build_value_index(load_records(open_store(), profiles, ttl))
+
+    count = 0
+    write_text (f"Searching for r53 records pointing at {len(values)} values, in aws account/profile {profile_name}!")
+    for value, records in lookup_values(index, values):
+        if not records:
+            write_text (f"   {value}: no records found")
+        for record in records:
+            count += 1
+            write_record (dict(record, value=value), f" #{count:3d};  value: {value};  name: {record['name']};  type: {record['type']};  profile: {record['profile']};  zone: {record['zone']} ({record['zone_id']})")
+    if (count > 0):
+        write_text (f"Total {count} records found")
+    else:
+        write_text ("Sorry, no records found, maybe filter is not good")
+    write_text (" ")
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
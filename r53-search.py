@@ -3,36 +3,37 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, getopt, yaml
-from uuid import uuid4
+import sys, getopt, yaml
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from inventory_store import open_store, default_ttl
+from r53_index import load_records, build_trie, lookup
+from report_output import set_format, write_text, write_record
 
 global_cfg_ini_file="config.yaml"
 global_config = []
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_zones(session, zone_name):
-    zones = []
     # filter_list = []
     # if (zone_name != "*"):
     #     filter_list.append ({'Name':'tag:Name', 'Values':["*"+zone_name+"*"]})
 
-    r53_client = session.client('route53')
-    response=r53_client.list_hosted_zones () # (Filters=filter_list)
-    for zone in response['HostedZones']:
+    r53_client = get_client(session, 'route53')
+    for zone in iterate(r53_client, 'list_hosted_zones', 'HostedZones'):
         # print (zone["Name"])
         if zone_name+"." == zone["Name"]:
-            zones.append (zone)
-    return zones
+            yield zone
 
 # process command line arguments and return list of key pair values
 def process_cli_arguments (argv):
-    parameters = ["*", "*", "*"]
+    parameters = ["*", "*", "*", None, False, "text"]
     try:
-        opts, args = getopt.getopt(argv,"a:r:n:p:h",["region=","name=","profile=","--help"])
+        opts, args = getopt.getopt(argv,"a:r:n:p:q:fF:h",["region=","name=","profile=","record=","refresh","format=","--help"])
     except getopt.GetoptError:
         print ("Invalid parameters, to see parameter map use:")
         print ("   ec2-search.py -h")
@@ -43,6 +44,9 @@ def process_cli_arguments (argv):
             print ("Usage: ec2-search.py --name <zone_name> --region <region> --profile <profile_name> --help")
             print ("   or: ec2-search.py -n <zone_name> -r <region> -p <profile_name> -h")
             print ("   Assumed * for zone_name and region, default for profile_name if not specified")
+            print ("   --record (-q) <record> searches records of all zones, e.g. www.example.com or *.example.com for all records below it")
+            print ("   --refresh (-f) re-reads records from route53 instead of local snapshot")
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes found zones or records as records, default text")
             sys.exit()
         elif opt in ("-n", "--name"):
             parameters[0]=arg
@@ -50,36 +54,68 @@ def process_cli_arguments (argv):
             parameters[1]=arg
         elif opt in ("-p", "--profile"):
             parameters[2]=arg
+        elif opt in ("-q", "--record"):
+            parameters[3]=arg
+        elif opt in ("-f", "--refresh"):
+            parameters[4]=True
+        elif opt in ("-F", "--format"):
+            parameters[5]=arg
         else:
             assert False, "unhandled option"
 
     return parameters
 
+def format_record(record):
+    values = record['alias'] if record['alias'] else ", ".join(record['values'])
+    return f"{record['name']};  type: {record['type']};  value: {values};  profile: {record['profile']};  zone: {record['zone']} ({record['zone_id']})"
+
+# search records of all zones of all profiles in local record index
+def search_records(global_config, record_name, profile_name, refresh):
+    profiles = [profile for profile in global_config['profiles'] if (profile_name == "*" or profile == profile_name)]
+    ttl = 0 if refresh else global_config.get('inventory_ttl', default_ttl)
+    records = load_records(open_store(), profiles, ttl)
+    write_text (f"Searching for r53 records named like {record_name}, in aws account/profile {profile_name}, in {len(records)} records!")
+    found = lookup(build_trie(records), record_name)
+    for count, record in enumerate(found, 1):
+        write_record (record, f" #{count:3d};  name: {format_record(record)}")
+    if found:
+        write_text (f"Total {len(found)} records found")
+    else:
+        write_text ("Sorry, no records found, maybe filter is not good")
+    write_text (" ")
+
 def main(argv=None):
     global_config = parse_config_file()
     parameters = process_cli_arguments(argv)
     zone_name=parameters[0]
     region_name=parameters[1]
     profile_name=parameters[2]
+    record_name=parameters[3]
+    refresh=parameters[4]
+    set_format(parameters[5])
+
+    if record_name:
+        search_records(global_config, record_name, profile_name, refresh)
+        return
 
     count = 0
-    print (f"Searching for r53 zones named like {zone_name}, in aws account/profile {profile_name}, in region {region_name}!")
+    write_text (f"Searching for r53 zones named like {zone_name}, in aws account/profile {profile_name}, in region {region_name}!")
     for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
+        session = get_session(profile)
         # for region in session.client('ec2').describe_regions()['Regions']:
             # if (region_name=="*" or region_name==region["RegionName"]):
         zones = get_zones(session, zone_name)
-        if zones:
-            print ("Profile: ", profile)
-            for zone in zones:
-                count += 1
-                print ("   ", zone["Name"], zone)
+        for i, zone in enumerate(zones):
+            if i == 0:
+                write_text (f"Profile:  {profile}")
+            count += 1
+            write_record (dict(zone, profile=profile), f"    {zone['Name']} {zone}")
                 # print (f" #{count:3d};  name: {get_ec2_tag(instance,'Name')};  profile: {profile};  region: {region['RegionName']};  id: {instance['InstanceId']};")
     if (count > 0):
-        print (f"Total {count} zones found")
+        write_text (f"Total {count} zones found")
     else:
-        print ("Sorry, no zones found, maybe filter is not good")
-    print (" ")
+        write_text ("Sorry, no zones found, maybe filter is not good")
+    write_text (" ")
 
 if __name__ == '__main__':
     main(sys.argv[1:])
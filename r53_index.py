@@ -0,0 +1,140 @@
+# Purpose: route53 records of all aws accounts/profiles and a local index over them.
+#
+# Hosted zones and their record sets are swept concurrently with paginated
+# calls and kept in the inventory snapshot store (.cache/inventory.sqlite),
+# so repeated searches do not call route53 until the snapshot expires.
+# Records are indexed in a trie of reversed name labels
+# (com -> example -> foo -> www), which answers suffix ("*.foo.example.com")
+# and exact name queries, with dns wildcard records, in milliseconds.
+# A reverse index maps record values (ip, alias or cname target) back to
+# the records pointing at them, for r53-reverse-search.py.
+
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from inventory_store import get_or_fetch, default_ttl
+from aws_fanout import default_max_workers
+
+records_key = ""
+
+def normalize_name(name):
+    # route53 returns "*" as octal escape \052
+    return name.replace("\\052", "*").rstrip(".").lower()
+
+def get_zones(session):
+    r53_client = get_client(session, 'route53')
+    return iterate(r53_client, 'list_hosted_zones', 'HostedZones')
+
+def get_records(session, profile, zone):
+    r53_client = get_client(session, 'route53')
+    for record in iterate(r53_client, 'list_resource_record_sets', 'ResourceRecordSets', HostedZoneId=zone['Id']):
+        yield {
+            'profile': profile,
+            'zone': normalize_name(zone['Name']),
+            'zone_id': zone['Id'],
+            'private': zone.get('Config', {}).get('PrivateZone', False),
+            'name': normalize_name(record['Name']),
+            'type': record['Type'],
+            'ttl': record.get('TTL'),
+            'values': [r['Value'] for r in record.get('ResourceRecords', [])],
+            'alias': normalize_name(record['AliasTarget']['DNSName']) if 'AliasTarget' in record else None,
+        }
+
+def load_records(store, profiles, ttl=default_ttl, max_workers=default_max_workers, errors=None):
+    """
+    Returns records of all zones of the given profiles, from snapshot when
+    fresh, ttl=0 sweeps route53 again. Sessions are created only for fetches.
+    Failed sweeps are raised or appended to errors, see get_or_fetch.
+    """
+    zones = get_or_fetch(store, [(profile, "*") for profile in profiles], 'r53-zone',
+                         lambda unit: get_zones(get_session(unit[0])), ttl, max_workers, errors)
+    zone_by_unit = {(profile, zone['Id']): zone for (profile, _), profile_zones in zones.items() for zone in profile_zones}
+    records = get_or_fetch(store, list(zone_by_unit), 'r53-record',
+                           lambda unit: get_records(get_session(unit[0]), unit[0], zone_by_unit[unit]), ttl, max_workers, errors)
+    return [record for zone_records in records.values() for record in zone_records]
+
+def build_trie(records):
+    trie = {}
+    for record in records:
+        node = trie
+        for label in reversed(record['name'].split(".")):
+            node = node.setdefault(label, {})
+        node.setdefault(records_key, []).append(record)
+    return trie
+
+def find_node(trie, name):
+    node = trie
+    for label in reversed(name.split(".")):
+        node = node.get(label)
+        if node is None:
+            return None
+    return node
+
+def walk(node):
+    for label, child in node.items():
+        if label == records_key:
+            yield from child
+        else:
+            yield from walk(child)
+
+def lookup(trie, query):
+    """
+    Returns records answering query:
+      "*.foo.example.com" - all records below foo.example.com (suffix search)
+      "www.foo.example.com" - records of that name, or when the name does not
+                              exist, the dns wildcard record of its closest
+                              existing ancestor (*.foo.example.com)
+    A name without records but with names below it (empty non-terminal) exists,
+    so a wildcard does not answer it (RFC 4592), run with python -m doctest:
+
+    >>> trie = build_trie([{'name': n} for n in ("*.example.com", "a.b.example.com")])
+    >>> [r['name'] for r in lookup(trie, "www.example.com")]
+    ['*.example.com']
+    >>> [r['name'] for r in lookup(trie, "b.example.com")]
+    []
+    >>> [r['name'] for r in lookup(trie, "c.b.example.com")]
+    []
+    """
+    query = normalize_name(query)
+    if query == "*":
+        return list(walk(trie))
+    if query.startswith("*."):
+        node = find_node(trie, query[2:])
+        if node is None:
+            return []
+        return [record for label, child in node.items() if label != records_key for record in walk(child)]
+
+    node = trie
+    for label in reversed(query.split(".")):
+        if label not in node:
+            # the name does not exist, node is its closest existing ancestor
+            return list(node.get("*", {}).get(records_key, []))
+        node = node[label]
+    return list(node.get(records_key, []))
+
+# record types whose values point at an address or another name
+value_types = {"A", "AAAA", "CNAME"}
+
+def normalize_value(value):
+    value = normalize_name(value.strip())
+    # elb alias targets are "dualstack.<elb dns name>"
+    if value.startswith("dualstack."):
+        value = value[len("dualstack."):]
+    return value
+
+def build_value_index(records):
+    """
+    Reverse index: normalized value (ip, elb/cloudfront dns name, cname
+    target) -> records pointing at it, over A/AAAA/CNAME and alias records.
+    """
+    index = {}
+    for record in records:
+        if record['alias']:
+            index.setdefault(normalize_value(record['alias']), []).append(record)
+        elif record['type'] in value_types:
+            for value in record['values']:
+                index.setdefault(normalize_value(value), []).append(record)
+    return index
+
+def lookup_values(index, values):
+    """Returns [(value, records)] for every value, in the given order."""
+    return [(value, index.get(normalize_value(value), [])) for value in values]
@@ -0,0 +1,76 @@
+# Purpose: shared output writer of the reports and searches.
+#
+# In the default text format scripts print their usual lines. With
+# -F/--format jsonl or csv every finding or search result is written as one
+# json line or csv row, as soon as it is found, and flushed, so the output
+# can be piped into other tools while the scan is running. Banners, totals
+# and other text are left out of jsonl and csv output.
+# When the reader goes away (e.g. | head) the script exits quietly, reports
+# that save state at the end (findings_delta.py) finish the scan without
+# output instead, so the state is complete.
+
+import os, sys, csv, json
+
+formats = ("text", "jsonl", "csv")
+output_format = "text"
+csv_fields = None
+csv_writer = None
+keep_running = False
+
+def set_format(fmt, fields=None):
+    """Selects output format, fields are csv columns (default: keys of the first record)."""
+    global output_format, csv_fields, csv_writer
+    if fmt not in formats:
+        print (f"Unknown format {fmt}, use one of: {', '.join(formats)}")
+        sys.exit(2)
+    output_format = fmt
+    csv_fields = list(fields) if fields else None
+    csv_writer = None
+
+def keep_running_when_closed():
+    """Closed stdout no longer ends the script, output goes to /dev/null."""
+    global keep_running
+    keep_running = True
+
+def output_closed():
+    # later writes and the flush at exit go to /dev/null instead of raising again
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+    if not keep_running:
+        sys.exit(1)
+
+def is_text():
+    return output_format == "text"
+
+def write_text(line=""):
+    """Prints line in text format only."""
+    if output_format == "text":
+        try:
+            print (line)
+        except BrokenPipeError:
+            output_closed()
+
+def csv_value(value):
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+    return value
+
+def write_record(record, line=None):
+    """Writes one result: line in text format (when given), the record dict otherwise."""
+    global csv_writer
+    try:
+        if output_format == "text":
+            if line is not None:
+                print (line)
+            return
+        if output_format == "jsonl":
+            sys.stdout.write(json.dumps(record, default=str) + "\n")
+        else:
+            if csv_writer is None:
+                csv_writer = csv.DictWriter(sys.stdout, fieldnames=csv_fields or list(record), extrasaction="ignore")
+                csv_writer.writeheader()
+            csv_writer.writerow({key: csv_value(value) for key, value in record.items()})
+        sys.stdout.flush()
+    except BrokenPipeError:
+        output_closed()
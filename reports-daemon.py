@@ -0,0 +1,224 @@
+# Purpose: optional long running daemon that keeps sessions, clients,
+# credentials and the latest inventory in memory, and answers ec2-search
+# --cached and r53-search --record queries over a unix socket, so
+# interactive lookups take tens of milliseconds instead of a cold start.
+# ec2 instances, regions and route53 records of all profiles are refreshed
+# in the background, every --interval seconds.
+#
+# aws-reports.py sends ec2-search and r53-search to the daemon when its
+# socket exists (.cache/reports.sock, AWS_REPORTS_CACHE moves it), and runs
+# them itself when the daemon does not answer them. Answered are only
+# queries of the in-memory inventory, one at a time, in the daemon's
+# directory and with its config.yaml. Queries calling aws (without
+# --cached, r53-search --refresh or zone search), queries with --api-stats,
+# whose calls could not be told apart from the refresh, and clients started
+# elsewhere are run by the client. Queries read the latest snapshots
+# whatever their age, profiles or regions whose refresh failed keep their
+# previous snapshot, and a query needing a snapshot that was never fetched
+# is run by the client too, so a warm query never waits for aws.
+#
+# Protocol: one json line {"command", "argv", "cwd"} per connection, answered
+# with one json line {"stdout", "stderr", "exit_code"} or {"error"}.
+#
+# Author Predrag Vlajkovic, 2024
+
+from __future__ import print_function
+import os, io, sys, json, time, getopt, runpy, socket, threading, traceback, socketserver, yaml
+from contextlib import redirect_stdout, redirect_stderr
+from aws_clients import get_session, get_client, set_max_clients
+from aws_fanout import default_max_workers
+from aws_paging import iterate
+from inventory_store import open_store, get_or_fetch, snapshot_key, snapshots_only, SnapshotMissing
+from ec2_index import get_index
+from r53_index import load_records
+import api_stats
+from cache_paths import cache_path
+
+global_cfg_ini_file="config.yaml"
+global_config = []
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+socket_file = cache_path("reports.sock")
+daemon_commands = ("ec2-search", "r53-search")
+# options of queries answered from the in-memory inventory, and of those still calling aws
+memory_options = {"ec2-search": ("-c", "--cached"), "r53-search": ("-q", "--record")}
+live_options = {"r53-search": ("-f", "--refresh")}
+default_interval = 600
+# clients of every profile and region are reused by the refresh and queries
+max_clients = 1024
+
+# scripts print to (redirected) sys.stdout, so queries are run one at a time,
+# each takes milliseconds as only queries of the in-memory inventory are run
+run_lock = threading.Lock()
+
+def parse_config_file():
+    with open(global_cfg_ini_file) as f:
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    return config
+
+def get_regions(session):
+    return get_client(session, 'ec2').describe_regions()['Regions']
+
+def get_instances(session, region_name):
+    ec2_client = get_client(session, 'ec2', region_name=region_name)
+    return iterate(ec2_client, 'describe_instances', 'Reservations[].Instances[]')
+
+def is_memory_query(command, argv):
+    options = {arg.split("=")[0] for arg in argv}
+    return bool(options & set(memory_options[command])) and not options & set(live_options.get(command, ()))
+
+def has_api_stats(argv):
+    return any(arg == api_stats.option or arg.startswith(api_stats.option + "=") for arg in argv)
+
+def run_script(command, argv):
+    """
+    Runs command's script in this process, on snapshots only, returns
+    (stdout, stderr, exit code). Raises SnapshotMissing when it needs a
+    snapshot that was never fetched.
+    """
+    script = os.path.join(script_dir, f"{command}.py")
+    stdout, stderr = io.StringIO(), io.StringIO()
+    exit_code = 0
+    with run_lock, snapshots_only(), redirect_stdout(stdout), redirect_stderr(stderr):
+        sys.argv = [script] + argv
+        try:
+            runpy.run_path(script, run_name="__main__")
+        except SnapshotMissing:
+            raise
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+    return stdout.getvalue(), stderr.getvalue(), exit_code
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            command, argv, cwd = request["command"], list(request["argv"]), request.get("cwd")
+        except (ValueError, KeyError, TypeError):
+            reply = {"error": "invalid request"}
+        else:
+            if command not in daemon_commands:
+                reply = {"error": f"{command} is not answered by the daemon"}
+            elif cwd and os.path.realpath(cwd) != os.getcwd():
+                reply = {"error": f"daemon runs in {os.getcwd()}"}
+            elif not is_memory_query(command, argv):
+                reply = {"error": "query calls aws, run by the client"}
+            elif has_api_stats(argv):
+                reply = {"error": f"{api_stats.option} is measured by a local run"}
+            else:
+                try:
+                    stdout, stderr, exit_code = run_script(command, argv)
+                    reply = {"stdout": stdout, "stderr": stderr, "exit_code": exit_code}
+                except SnapshotMissing as e:
+                    reply = {"error": f"{e}, run by the client"}
+        self.wfile.write((json.dumps(reply) + "\n").encode())
+
+def refresh(profiles, workers):
+    """
+    Re-reads ec2 instances, regions and route53 records of profiles into the
+    inventory snapshot, kept in memory by the store, and builds the ec2 index
+    of all instances, so queries find them in memory. A failed profile or
+    region keeps its previous snapshot, returns the failures as
+    (kind, unit, exception).
+    """
+    errors = []
+    store = open_store()
+    regions = get_or_fetch(store, [(profile, "*") for profile in profiles], 'region',
+                           lambda unit: get_regions(get_session(unit[0])), 0, workers, errors)
+    units = [(profile, region["RegionName"]) for (profile, _), profile_regions in regions.items() for region in profile_regions]
+    inventory = get_or_fetch(store, units, 'ec2', lambda unit: get_instances(get_session(unit[0]), unit[1]), 0, workers, errors)
+    load_records(store, profiles, 0, workers, errors)
+    # same key as ec2-search.py --cached of all profiles, when every unit has a snapshot
+    get_index(snapshot_key(store, units, 'ec2'), lambda: ((unit, instance) for unit in inventory for instance in inventory[unit]))
+    store.close()
+    return errors
+
+def refresh_loop(profiles, interval, workers):
+    while True:
+        start = time.time()
+        try:
+            errors = refresh(profiles, workers)
+            for kind, unit, error in errors:
+                print (f"Refresh of {kind} in {unit[0]} {unit[1]} failed, kept previous snapshot: {error}", file=sys.__stderr__, flush=True)
+            print (f"Refreshed inventory of {len(profiles)} profiles in {time.time()-start:.1f}s, {len(errors)} failed", file=sys.__stdout__, flush=True)
+        except Exception as e:
+            print (f"Inventory refresh failed: {e}", file=sys.__stderr__, flush=True)
+        if not interval:
+            return
+        time.sleep(max(0, interval - (time.time() - start)))
+
+def is_running(path):
+    with socket.socket(socket.AF_UNIX) as s:
+        try:
+            s.connect(path)
+            return True
+        except OSError:
+            return False
+
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = [socket_file, default_interval, default_max_workers]
+    try:
+        opts, args = getopt.getopt(argv,"s:i:w:h",["socket=","interval=","workers=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   reports-daemon.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: reports-daemon.py --socket <path> --interval <seconds> --workers <workers> --help")
+            print ("   or: reports-daemon.py -s <path> -i <seconds> -w <workers> -h")
+            print (f"   Assumed {socket_file} and {default_interval} seconds if not specified, --interval 0 refreshes only at start")
+            print ("   Answers ec2-search --cached and r53-search --record queries sent by aws-reports.py, run it in the directory of config.yaml")
+            sys.exit()
+        elif opt in ("-s", "--socket"):
+            parameters[0]=arg
+        elif opt in ("-i", "--interval"):
+            parameters[1]=int(arg)
+        elif opt in ("-w", "--workers"):
+            parameters[2]=int(arg)
+        else:
+            assert False, "unhandled option"
+
+    return parameters
+
+def main(argv=None):
+    global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    path=parameters[0]
+    interval=parameters[1]
+    workers=parameters[2]
+
+    if os.path.exists(path):
+        if is_running(path):
+            print (f"Daemon is already running on {path}")
+            sys.exit(1)
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    sys.path.insert(0, script_dir)
+    set_max_clients(max_clients)
+
+    # socket only for this user
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, QueryHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    threading.Thread(target=refresh_loop, args=(global_config['profiles'], interval, workers), daemon=True).start()
+    print (f"Answering ec2-search --cached and r53-search --record on {path}, refreshing inventory every {interval}s", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
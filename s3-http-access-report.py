@@ -4,46 +4,47 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, botocore
-import yaml
-from uuid import uuid4
+import sys
+import yaml, getopt
+from s3_posture import scan_buckets, csv_fields, print_http_access_view, http_access_fields
+from report_output import set_format
 
 global_cfg_ini_file="config.yaml"
 global_config = []
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = ["text"]
+    try:
+        opts, args = getopt.getopt(argv,"F:h",["format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   s3-http-access-report.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: s3-http-access-report.py --format <text|jsonl|csv> --help")
+            print ("   or: s3-http-access-report.py -F <text|jsonl|csv> -h")
+            print ("   --format (-F) jsonl or csv writes findings as records, default text")
+            sys.exit()
+        elif opt in ("-F", "--format"):
+            parameters[0]=arg
+        else:
+            assert False, "unhandled option"
+    return parameters
+
 def main(argv=None):
     global_config = parse_config_file()
-    count = 0
-    total = 0
-
-    print ("\nS 3   R E P O R T\n")
-    print ("List of S3 buckets that do not meet security policies (CIS AWS 1.4.0 compliance).")
-    print (" - Bucket public access is not blocked -")
-    print ("")
-
-    for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        s3 = session.client('s3')
-        buckets = s3.list_buckets()['Buckets']
-        for bucket in buckets:
-            try:
-                bucket_policy = s3.get_bucket_policy (Bucket=bucket['Name'])
-                policy = bucket_policy['Policy']
-                if not "aws:SecureTransport" in policy:
-                    count+=1
-            except botocore.exceptions.ClientError as e:
-                print (f"  {count+1:4} - Profile; {profile:14}   Bucket: {bucket['Name']}   Finding: missing block http policy;")
-                count+=1
-                pass
-            total+=1
-
-    print (f"\nFound total {total} buckets, and {count} buckets have security issue.")
-    print ("\nEnd of report.")
+    parameters = process_cli_arguments(argv)
+    set_format(parameters[0], csv_fields)
+    records = scan_buckets(global_config['profiles'], http_access_fields)
+    print_http_access_view(records)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
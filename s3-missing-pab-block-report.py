@@ -4,63 +4,69 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, botocore
-import yaml
-from uuid import uuid4
+import sys
+import yaml, getopt
+from s3_posture import scan_buckets, print_header, print_missing_pab_view, missing_pab_fields
+from s3_posture import get_missing_pab_findings, format_missing_pab_finding, csv_fields
+from findings_delta import load_state, save_state, evaluate, print_delta
+from report_output import set_format, write_text, keep_running_when_closed
 
 global_cfg_ini_file="config.yaml"
 global_config = []
+report_name = "s3-missing-pab-block-report"
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
-def main(argv=None):
-    global_config = parse_config_file()
-    count = 0
-    total = 0
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = [False, "text"]
+    try:
+        opts, args = getopt.getopt(argv,"dF:h",["delta","format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   s3-missing-pab-block-report.py -h")
+        sys.exit(2)
 
-    print ("\nS 3   R E P O R T\n")
-    print ("List of S3 buckets that do not meet security policies (CIS AWS 1.4.0 compliance).")
-    print (" - Bucket public access is not blocked -")
-    print ("")
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: s3-missing-pab-block-report.py --delta --format <text|jsonl|csv> --help")
+            print ("   or: s3-missing-pab-block-report.py -d -F <text|jsonl|csv> -h")
+            print ("   --delta (-d) prints only new, resolved and changed findings since previous run")
+            print ("   --format (-F) jsonl or csv writes findings as records, default text")
+            sys.exit()
+        elif opt in ("-d", "--delta"):
+            parameters[0]=True
+        elif opt in ("-F", "--format"):
+            parameters[1]=arg
+        else:
+            assert False, "unhandled option"
+    return parameters
 
-    for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        s3 = session.client('s3')
-        buckets = s3.list_buckets()['Buckets']
-        for bucket in buckets:
-            bpab = "-"
-            total+=1
-            try:
-                bpab = s3.get_public_access_block(Bucket=bucket['Name'])
-                pabc = bpab['PublicAccessBlockConfiguration']
-                if not (pabc['BlockPublicAcls'] and pabc['IgnorePublicAcls'] and pabc['BlockPublicPolicy'] and pabc['RestrictPublicBuckets']):
-                    pass
-            except botocore.exceptions.ClientError as e:
-                try:
-                    bucket_policy = s3.get_bucket_policy (Bucket=bucket['Name'])
-                    pass
-                except botocore.exceptions.ClientError as e:
-                    print (f"  {count+1:4} - Profile: {profile:14}  Bucket: {bucket['Name']}    Finding: Missing PAB block and missing bucket policy")
-                    count+=1
-                    # this bucket can be updated with PAB set to true
-                    # if "cf-templates-" in bucket['Name']:
-                    #     print (f"         - Updating bucket: {bucket['Name']}")
-                    #     response = s3.put_public_access_block(
-                    #         Bucket=bucket['Name'],
-                    #         PublicAccessBlockConfiguration={
-                    #             'BlockPublicAcls': True,
-                    #             'IgnorePublicAcls': True,
-                    #             'BlockPublicPolicy': True,
-                    #             'RestrictPublicBuckets': True
-                    #         },
-                    #     )
+def main(argv=None):
+    global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    delta=parameters[0]
+    set_format(parameters[1], csv_fields)
+    # saved state covers all buckets, also when the reader of stdout is gone
+    keep_running_when_closed()
+    records = scan_buckets(global_config['profiles'], missing_pab_fields)
 
+    # buckets with unchanged posture are not evaluated again
+    old_state = load_state(report_name)
+    new_state = {}
+    for r in records:
+        evaluate(old_state, new_state, f"{r['profile']}/{r['bucket']}", r, lambda: get_missing_pab_findings(r))
+    save_state(report_name, new_state)
 
-    print (f"\nFound total {total} buckets, and {count} buckets have security issue.")
-    print ("\nEnd of report.")
+    if delta:
+        print_header("Bucket public access is not blocked")
+        print_delta(old_state, new_state, format_missing_pab_finding)
+        write_text ("\nEnd of report.")
+    else:
+        print_missing_pab_view(records)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
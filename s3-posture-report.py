@@ -0,0 +1,52 @@
+# Purpose: in all accouts run all s3 reports (CIS AWS 1.4.0 compliance,
+# missing PAB block, missing http block policy) from one sweep of buckets
+#
+# Author Predrag Vlajkovic, 2024
+
+from __future__ import print_function
+import sys
+import yaml, getopt
+from s3_posture import scan_buckets, csv_fields, print_template_view, print_missing_pab_view, print_http_access_view
+from report_output import set_format
+
+global_cfg_ini_file="config.yaml"
+global_config = []
+
+def parse_config_file():
+    with open(global_cfg_ini_file) as f:
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+    return config
+
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = ["text"]
+    try:
+        opts, args = getopt.getopt(argv,"F:h",["format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   s3-posture-report.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: s3-posture-report.py --format <text|jsonl|csv> --help")
+            print ("   or: s3-posture-report.py -F <text|jsonl|csv> -h")
+            print ("   --format (-F) jsonl or csv writes findings as records, default text")
+            sys.exit()
+        elif opt in ("-F", "--format"):
+            parameters[0]=arg
+        else:
+            assert False, "unhandled option"
+    return parameters
+
+def main(argv=None):
+    global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    set_format(parameters[0], csv_fields)
+    records = scan_buckets(global_config['profiles'])
+    print_template_view(records)
+    print_missing_pab_view(records)
+    print_http_access_view(records)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -4,51 +4,47 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, botocore
-import yaml
-from uuid import uuid4
+import sys
+import yaml, getopt
+from s3_posture import scan_buckets, csv_fields, print_template_view, template_fields
+from report_output import set_format
 
 global_cfg_ini_file="config.yaml"
 global_config = []
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = ["text"]
+    try:
+        opts, args = getopt.getopt(argv,"F:h",["format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   s3-search-template.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: s3-search-template.py --format <text|jsonl|csv> --help")
+            print ("   or: s3-search-template.py -F <text|jsonl|csv> -h")
+            print ("   --format (-F) jsonl or csv writes findings as records, default text")
+            sys.exit()
+        elif opt in ("-F", "--format"):
+            parameters[0]=arg
+        else:
+            assert False, "unhandled option"
+    return parameters
+
 def main(argv=None):
     global_config = parse_config_file()
-    count = 1
-
-    print ("\nS 3   R E P O R T\n")
-    print ("List of S3 buckets that do not meet security policies (CIS AWS 1.4.0 compliance).")
-    print ("")
-
-    for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        s3 = session.client('s3')
-        buckets = s3.list_buckets()['Buckets']
-        for bucket in buckets:
-            versioning = bpa = bp = "-"
-            try:
-                response = s3.get_bucket_versioning(Bucket=bucket['Name'])
-                if 'Status' in response:
-                    versioning = response['Status']
-            except botocore.exceptions.ClientError as e:
-                pass
-            try:
-                bpa = s3.get_public_access_block(Bucket=bucket['Name'])['PublicAccessBlockConfiguration']
-            except botocore.exceptions.ClientError as e:
-                pass
-            try:
-                bp = s3.get_bucket_policy(Bucket=bucket['Name'])['Policy']
-            except botocore.exceptions.ClientError as e:
-                pass
-
-            print (f"{count:2} - Bucket: {bucket['Name']};  Versioning: {versioning}; BPS: {bpa};  Policy: {bp}")
-            count+=1
-
-    print ("\nEnd of report.")
+    parameters = process_cli_arguments(argv)
+    set_format(parameters[0], csv_fields)
+    records = scan_buckets(global_config['profiles'], template_fields)
+    print_template_view(records)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
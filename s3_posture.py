@@ -0,0 +1,114 @@
+# Purpose: single pass s3 posture scanner and the report views over it.
+#
+# Every bucket of every profile is probed once for versioning, public
+# access block, bucket policy and location, into a posture record:
+#   {'profile', 'bucket', 'versioning', 'public_access_block', 'policy', 'location'}
+# Missing settings are None. The s3 reports are views over these records,
+# so running all s3 checks costs one sweep (see s3-posture-report.py).
+
+import sys
+import botocore.exceptions
+from s3_probe import run_probes
+from aws_retry import is_throttle, error_code
+from report_output import write_text, write_record
+
+fetchers = {
+    'versioning': lambda s3, name: s3.get_bucket_versioning(Bucket=name).get('Status'),
+    'public_access_block': lambda s3, name: s3.get_public_access_block(Bucket=name)['PublicAccessBlockConfiguration'],
+    'policy': lambda s3, name: s3.get_bucket_policy(Bucket=name)['Policy'],
+    'location': lambda s3, name: s3.get_bucket_location(Bucket=name).get('LocationConstraint') or 'us-east-1',
+}
+all_fields = tuple(fetchers)
+# errors that mean the setting is not configured on the bucket
+not_configured_codes = {'NoSuchPublicAccessBlockConfiguration', 'NoSuchBucketPolicy'}
+
+def fetch(s3, name, field):
+    try:
+        return fetchers[field](s3, name)
+    except botocore.exceptions.ClientError as e:
+        if is_throttle(e):
+            raise
+        if error_code(e) not in not_configured_codes:
+            print(f"{name}: {field}: {error_code(e)}", file=sys.stderr)
+        return None
+
+def scan_buckets(profiles, fields=all_fields):
+    """Returns posture records of all buckets, only given fields are fetched."""
+    probe = lambda s3, bucket: {field: fetch(s3, bucket['Name'], field) for field in fields}
+    records = []
+    for profile, bucket, posture in run_probes(profiles, probe):
+        posture.update(profile=profile, bucket=bucket['Name'])
+        records.append(posture)
+    return records
+
+# csv columns of all views, records of each view carry the 'report' they belong to
+csv_fields = ('report', 'profile', 'bucket', 'finding', 'versioning', 'public_access_block', 'policy', 'location', 'change')
+
+def print_header(subtitle=None):
+    write_text ("\nS 3   R E P O R T\n")
+    write_text ("List of S3 buckets that do not meet security policies (CIS AWS 1.4.0 compliance).")
+    if subtitle:
+        write_text (f" - {subtitle} -")
+    write_text ("")
+
+# s3-search-template.py view: all fetched settings of every bucket
+template_fields = ('versioning', 'public_access_block', 'policy')
+def print_template_view(records):
+    print_header()
+    count = 1
+    for r in records:
+        versioning = r['versioning'] or "-"
+        bpa = r['public_access_block'] or "-"
+        bp = r['policy'] or "-"
+        write_record (dict(r, report="s3-search-template"), f"{count:2} - Bucket: {r['bucket']};  Versioning: {versioning}; BPS: {bpa};  Policy: {bp}")
+        count+=1
+    write_text ("\nEnd of report.")
+
+# s3-missing-pab-block-report.py view: buckets without PAB block and without policy
+missing_pab_fields = ('public_access_block', 'policy')
+def get_missing_pab_findings(r):
+    if r['public_access_block'] is None and r['policy'] is None:
+        return [{'id': f"{r['profile']}/{r['bucket']}", 'profile': r['profile'], 'bucket': r['bucket'],
+                 'finding': "Missing PAB block and missing bucket policy"}]
+    return []
+
+def format_missing_pab_finding(f):
+    return f"Profile: {f['profile']:14}  Bucket: {f['bucket']}    Finding: {f['finding']}"
+
+def print_missing_pab_view(records):
+    print_header("Bucket public access is not blocked")
+    count = 0
+    for r in records:
+        for finding in get_missing_pab_findings(r):
+            write_record (dict(finding, report="s3-missing-pab-block-report"), f"  {count+1:4} - {format_missing_pab_finding(finding)}")
+            count+=1
+            # this bucket can be updated with PAB set to true
+            # if "cf-templates-" in r['bucket']:
+            #     print (f"         - Updating bucket: {r['bucket']}")
+            #     response = s3.put_public_access_block(
+            #         Bucket=r['bucket'],
+            #         PublicAccessBlockConfiguration={
+            #             'BlockPublicAcls': True,
+            #             'IgnorePublicAcls': True,
+            #             'BlockPublicPolicy': True,
+            #             'RestrictPublicBuckets': True
+            #         },
+            #     )
+    write_text (f"\nFound total {len(records)} buckets, and {count} buckets have security issue.")
+    write_text ("\nEnd of report.")
+
+# s3-http-access-report.py view: buckets whose policy does not deny plain http
+http_access_fields = ('policy',)
+def print_http_access_view(records):
+    print_header("Bucket public access is not blocked")
+    count = 0
+    for r in records:
+        if r['policy'] is not None:
+            if not "aws:SecureTransport" in r['policy']:
+                count+=1
+        else:
+            write_record ({'report': "s3-http-access-report", 'profile': r['profile'], 'bucket': r['bucket'], 'finding': "missing block http policy"},
+                          f"  {count+1:4} - Profile; {r['profile']:14}   Bucket: {r['bucket']}   Finding: missing block http policy;")
+            count+=1
+    write_text (f"\nFound total {len(records)} buckets, and {count} buckets have security issue.")
+    write_text ("\nEnd of report.")
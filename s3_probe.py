@@ -0,0 +1,48 @@
+# Purpose: asyncio engine that probes s3 buckets of many aws accounts/profiles.
+#
+# Buckets of all profiles are listed and probed concurrently. The probe is
+# a plain function making blocking boto3 calls, it runs on a thread pool
+# which bounds the number of probes in flight, while a semaphore per
+# profile bounds probes per account. Throttled calls are rate limited and
+# retried by the clients themselves (see aws_retry.py).
+
+import sys, time, asyncio
+from concurrent.futures import ThreadPoolExecutor
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+
+default_max_in_flight = 64
+default_per_account = 16
+
+def list_buckets(profile):
+    s3 = get_client(get_session(profile), 's3')
+    return s3, list(iterate(s3, 'list_buckets', 'Buckets'))
+
+async def probe_all(profiles, probe, max_in_flight, per_account):
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        listings = await asyncio.gather(*(loop.run_in_executor(executor, list_buckets, profile) for profile in profiles))
+        semaphores = {profile: asyncio.Semaphore(per_account) for profile in profiles}
+
+        async def probe_one(profile, s3, bucket):
+            async with semaphores[profile]:
+                return profile, bucket, await loop.run_in_executor(executor, probe, s3, bucket)
+
+        return await asyncio.gather(*(probe_one(profile, s3, bucket)
+                                      for profile, (s3, buckets) in zip(profiles, listings)
+                                      for bucket in buckets))
+
+def run_probes(profiles, probe, max_in_flight=default_max_in_flight, per_account=default_per_account):
+    """
+    Runs probe(s3_client, bucket) for every bucket of every profile and
+    returns list of (profile, bucket, result) in profile and bucket order.
+    A probe should let throttling ClientErrors (see aws_retry.is_throttle)
+    that are left after the client's retries propagate, rather than take
+    them for a missing setting. Throughput is printed to stderr.
+    """
+    start = time.perf_counter()
+    results = asyncio.run(probe_all(list(profiles), probe, max_in_flight, per_account))
+    elapsed = time.perf_counter() - start
+    rate = len(results) / elapsed if elapsed > 0 else 0.0
+    print(f"Probed {len(results)} buckets in {elapsed:.1f}s ({rate:.1f} buckets/sec)", file=sys.stderr)
+    return results
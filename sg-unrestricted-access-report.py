@@ -4,74 +4,121 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, botocore
-import yaml
-from uuid import uuid4
+import sys
+import yaml, getopt
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from aws_regions import get_enabled_regions, default_ttl
+from findings_delta import load_state, save_state, evaluate, print_delta
+from report_output import set_format, write_text, write_record, keep_running_when_closed
 
 global_cfg_ini_file="config.yaml"
 global_config = []
+report_name = "sg-unrestricted-access-report"
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_vpc_info (session, region):
-    ec2 = session.client('ec2', region_name=region)
-    response = ec2.describe_vpcs()
-    return response['Vpcs']
+    ec2 = get_client(session, 'ec2', region_name=region)
+    return iterate(ec2, 'describe_vpcs', 'Vpcs')
 
-def get_enabled_regions(boto3_session: boto3.Session, service: str):
-    regions = boto3_session.get_available_regions(service)
-    enabled_regions = set()
-    for region in regions:
-        sts_client = boto3_session.client('sts', region_name=region)
-        try:
-            sts_client.get_caller_identity()
-            enabled_regions.add(region)
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "InvalidClientTokenId":
-                pass
-            else:
-                raise
-    return enabled_regions
+# list all security groups and their rules of a region in one paginated sweep,
+# returns {VpcId: {GroupId: [rules]}}
+def get_region_sg_rules (session, region):
+    ec2 = get_client(session, 'ec2', region_name=region)
+    sgs_by_vpc = {}
+    group_vpc = {}
+    for sg in iterate(ec2, 'describe_security_groups', 'SecurityGroups'):
+        group_vpc[sg['GroupId']] = sg.get('VpcId', '-')
+        sgs_by_vpc.setdefault(group_vpc[sg['GroupId']], {})[sg['GroupId']] = []
+    for sgr in iterate(ec2, 'describe_security_group_rules', 'SecurityGroupRules'):
+        vpc_id = group_vpc.get(sgr['GroupId'], '-')
+        sgs_by_vpc.setdefault(vpc_id, {}).setdefault(sgr['GroupId'], []).append(sgr)
+    return sgs_by_vpc
+
+# returns findings for ingress rules of one security group open to the world
+def get_sg_findings (profile, region, vpc_id, sg_id, sgrs):
+    findings = []
+    for sgr in sgrs:
+        if sgr['IsEgress']==False:
+            if 'CidrIpv4' in sgr:
+                if sgr['CidrIpv4']=='0.0.0.0/0' or sgr['CidrIpv4']=="::/0":
+                    fromPort = 0 if sgr['FromPort']==-1 else sgr['FromPort']
+                    toPort = 65535 if sgr['ToPort']==-1 else sgr['ToPort']
+                    if fromPort==toPort: ports=fromPort
+                    else:
+                        ports=str(fromPort)+"-"+str(toPort)
+                    if not (ports==443 or ports==22 or ports==80):
+                        findings.append({'id': f"{profile}/{region}/{sgr['SecurityGroupRuleId']}", 'profile': profile, 'region': region,
+                                         'vpc': vpc_id, 'sg': sg_id, 'ports': ports, 'source': sgr['CidrIpv4']})
+    return findings
+
+def format_finding (f):
+    return f"Pofile: {f['profile']:12} Reion: {f['region']:16} VPC: {f['vpc']:24} SG: {f['sg']:23} Ports: {f['ports']:<11} Source: {f['source']}"
+
+# process command line arguments and return list of key pair values
+def process_cli_arguments (argv):
+    parameters = [False, "text"]
+    try:
+        opts, args = getopt.getopt(argv,"dF:h",["delta","format=","help"])
+    except getopt.GetoptError:
+        print ("Invalid parameters, to see parameter map use:")
+        print ("   sg-unrestricted-access-report.py -h")
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print ("Usage: sg-unrestricted-access-report.py --delta --format <text|jsonl|csv> --help")
+            print ("   or: sg-unrestricted-access-report.py -d -F <text|jsonl|csv> -h")
+            print ("   --delta (-d) prints only new, resolved and changed findings since previous run")
+            print ("   --format (-F) jsonl or csv writes findings as records while scanning, default text")
+            sys.exit()
+        elif opt in ("-d", "--delta"):
+            parameters[0]=True
+        elif opt in ("-F", "--format"):
+            parameters[1]=arg
+        else:
+            assert False, "unhandled option"
+    return parameters
 
 def main(argv=None):
     global_config = parse_config_file()
+    parameters = process_cli_arguments(argv)
+    delta=parameters[0]
+    set_format(parameters[1])
+    # state is saved at the end, a closed stdout must not cut the scan short
+    keep_running_when_closed()
     count = 1
+    old_state = load_state(report_name)
+    new_state = {}
 
-    print ("\nV P C   R E P O R T\n")
-    print ("List of Security group rules with unrestricted access (0.0.0.0/0).")
-    print ("")
+    write_text ("\nV P C   R E P O R T\n")
+    write_text ("List of Security group rules with unrestricted access (0.0.0.0/0).")
+    write_text ("")
 
     for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        available_regions = get_enabled_regions (session, "ec2")
+        session = get_session(profile)
+        available_regions = get_enabled_regions (session, "ec2", global_config.get('region_cache_ttl', default_ttl))
         for region in available_regions:
-            vpcs = get_vpc_info (session, region)
-            ec2 = session.client('ec2', region_name=region)
+            vpcs = list(get_vpc_info (session, region))
             if vpcs:
+                sgs_by_vpc = get_region_sg_rules (session, region)
                 for vpc in vpcs:
-                    sgs = ec2.describe_security_groups(Filters=[{ 'Name':'vpc-id', 'Values':[vpc['VpcId']] }])
-                    for sg in sgs['SecurityGroups']:
-                        sgrs = ec2.describe_security_group_rules(Filters=[{ 'Name':'group-id', 'Values':[sg['GroupId']] }])
-                        for sgr in sgrs['SecurityGroupRules']:
-                            if sgr['IsEgress']==False:
-                                try:
-                                    if 'CidrIpv4' in sgr:
-                                        if sgr['CidrIpv4']=='0.0.0.0/0' or sgr['CidrIpv4']=="::/0":
-                                            fromPort = 0 if sgr['FromPort']==-1 else sgr['FromPort']
-                                            toPort = 65535 if sgr['ToPort']==-1 else sgr['ToPort']
-                                            if fromPort==toPort: ports=fromPort
-                                            else:
-                                                ports=str(fromPort)+"-"+str(toPort)
-                                            if not (ports==443 or ports==22 or ports==80):
-                                                print (f"{count:4} - Pofile: {profile:12} Reion: {region:16} VPC: {vpc['VpcId']:24} SG: {sg['GroupId']:23} Ports: {ports:<11} Source: {sgr['CidrIpv4']}")
-                                                count+=1
-                                except botocore.exceptions.ClientError as e:
-                                    pass
-                    break
-    print ("\nEnd of report.")
+                    for sg_id, sgrs in sgs_by_vpc.get(vpc['VpcId'], {}).items():
+                        # security groups with unchanged rules are not evaluated again
+                        findings = evaluate(old_state, new_state, f"{profile}/{region}/{sg_id}", {'vpc': vpc['VpcId'], 'rules': sgrs},
+                                            lambda: get_sg_findings(profile, region, vpc['VpcId'], sg_id, sgrs))
+                        if not delta:
+                            for finding in findings:
+                                write_record (finding, f"{count:4} - {format_finding(finding)}")
+                                count+=1
+    save_state(report_name, new_state)
+    if delta:
+        print_delta(old_state, new_state, format_finding)
+    write_text ("\nEnd of report.")
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
@@ -4,65 +4,48 @@
 # Author Predrag Vlajkovic, 2023
 
 from __future__ import print_function
-import boto3, sys, botocore
+import sys
 import yaml, getopt
-from uuid import uuid4
+from collections import Counter
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from aws_regions import get_enabled_regions, default_ttl
+from findings_delta import load_state, save_state, evaluate, print_delta
+from report_output import set_format, write_text, write_record, keep_running_when_closed
 
 global_cfg_ini_file="config.yaml"
 global_config = []
+report_name = "vpc-empty-report"
 
 def parse_config_file():
     with open(global_cfg_ini_file) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+        config = yaml.load(f, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
     return config
 
 def get_vpc_info (session, region):
-    ec2 = session.client('ec2', region_name=region)
-    response = ec2.describe_vpcs(Filters=[{'Name':'isDefault','Values': ['false']},])
-    return response['Vpcs']
-
-def get_number_of_ec2s (session, region, vpc_id):
-    count=0
-    ec2 = session.client('ec2', region_name=region)
-    response = ec2.describe_instances(Filters=[{'Name':'vpc-id','Values': [vpc_id]},])
-    if response:
-        if response['Reservations']:
-            for instance in response['Reservations'][0]['Instances']:
-                count=count+1
-    return count
-
-def get_number_of_rdss (session, region, vpc_id):
-    count=0
-    rds = session.client('rds', region_name=region)
-    response = rds.describe_db_instances()
-    if response:
-        if response['DBInstances']:
-            for rds in response['DBInstances']:
-                if rds['DBSubnetGroup']['VpcId'] == vpc_id:
-                    count=count+1
-    return count
-
-def get_number_of_lambdas (session, region, vpc_id):
-    count=0
-    l = session.client('lambda', region_name=region)
-    response = l.list_functions()
-    if response:
-        if response['Functions']:
-            for f in response['Functions']:
-                if 'VpcConfig' in f:
-                    if f['VpcConfig']['VpcId'] == vpc_id:
-                        count=count+1
-    return count
-
-def get_number_of_ngws (session, region, vpc_id):
-    count=0
-    ngws = session.client('ec2', region_name=region)
-    response = ngws.describe_nat_gateways(Filters=[{'Name':'vpc-id','Values': [vpc_id]},])
-    if response:
-        if response['NatGateways']:
-            for f in response['NatGateways']:
-                count=count+1
-    return count
+    ec2 = get_client(session, 'ec2', region_name=region)
+    return iterate(ec2, 'describe_vpcs', 'Vpcs', Filters=[{'Name':'isDefault','Values': ['false']},])
+
+# count items of every page of a paginated call by their VpcId
+def count_by_vpc (client, operation, expression, get_vpc_id, **kwargs):
+    counts = Counter()
+    for item in iterate(client, operation, expression, **kwargs):
+        vpc_id = get_vpc_id(item)
+        if vpc_id:
+            counts[vpc_id] += 1
+    return counts
+
+# one pass over region resources, returns counts of ec2s, rdss, lambdas and ngws keyed by VpcId
+def get_region_inventory (session, region):
+    ec2 = get_client(session, 'ec2', region_name=region)
+    rds = get_client(session, 'rds', region_name=region)
+    lam = get_client(session, 'lambda', region_name=region)
+    return {
+        'ec2': count_by_vpc(ec2, 'describe_instances', 'Reservations[].Instances[]', lambda instance: instance.get('VpcId')),
+        'rds': count_by_vpc(rds, 'describe_db_instances', 'DBInstances', lambda db: db.get('DBSubnetGroup', {}).get('VpcId')),
+        'lambda': count_by_vpc(lam, 'list_functions', 'Functions', lambda f: f.get('VpcConfig', {}).get('VpcId')),
+        'ngw': count_by_vpc(ec2, 'describe_nat_gateways', 'NatGateways', lambda ngw: ngw.get('VpcId')),
+    }
 
 def get_name_tag(tags):
     vpc_name = "-"
@@ -74,75 +57,91 @@ def get_name_tag(tags):
                 return tag['Value']
     return vpc_name
 
-def get_enabled_regions(boto3_session: boto3.Session, service: str):
-    regions = boto3_session.get_available_regions(service)
-    enabled_regions = set()
-    for region in regions:
-        sts_client = boto3_session.client('sts', region_name=region)
-        try:
-            sts_client.get_caller_identity()
-            enabled_regions.add(region)
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == "InvalidClientTokenId":
-                pass
-            else:
-                raise
-    return enabled_regions
-
 # process command line arguments and return list of key pair values
 def process_cli_arguments (argv):
-    parameters = ["0"]
+    parameters = ["0", False, "text"]
     try:
-        opts, args = getopt.getopt(argv,"t:h",["target=","--help"])
+        opts, args = getopt.getopt(argv,"t:dF:h",["target=","delta","format=","help"])
     except getopt.GetoptError:
         print ("Invalid parameters, to see parameter map use:")
         print ("   vpc-empty-report.py -h")
         sys.exit(2)
 
     for opt, arg in opts:
-        if opt in ("h", "--help"):
-            print ("Usage: vpc-empty-report.py --target <target> --help")
-            print ("   or: vpc-empty-report.py -t <target> -h")
+        if opt in ("-h", "--help"):
+            print ("Usage: vpc-empty-report.py --target <target> [--delta] [--format <format>] --help")
+            print ("   or: vpc-empty-report.py -t <target> [-d] [-F format] -h")
+            print ("   --delta (-d) prints only new, resolved and changed findings since previous run")
+            print ("   --format (-F) <text|jsonl|csv> jsonl or csv writes findings as records while scanning, default text")
             sys.exit()
         elif opt in ("-t", "--target"):
             parameters[0]=arg
+        elif opt in ("-d", "--delta"):
+            parameters[1]=True
+        elif opt in ("-F", "--format"):
+            parameters[2]=arg
         else:
             assert False, "unhandled option"
     return parameters
 
+# returns finding for a VPC with compute resources combined less or equal then target
+def get_vpc_findings (profile, region, vpc, vpc_name, counts, target):
+    ec2s, rdss, lams, ngws = counts
+    if ec2s+rdss+lams > target:
+        return []
+    return [{'id': f"{profile}/{region}/{vpc['VpcId']}", 'profile': profile, 'region': region, 'vpc': vpc['VpcId'],
+             'cidr': vpc['CidrBlock'], 'name': vpc_name, 'ec2s': ec2s, 'rdss': rdss, 'lams': lams, 'ngws': ngws}]
+
+def format_finding (f):
+    return f"Profile: {f['profile']:14}  Region: {f['region']:16}  Vpc: {f['vpc']:23}  CIDR: {f['cidr']:18}  Name: {f['name']}"
+
+def format_counts (f):
+    return f"ec2: {f['ec2s']:2}    rds: {f['rdss']:2}    lambda: {f['lams']:2}     ngws: {f['ngws']}"
+
 def main(argv=None):
     global_config = parse_config_file()
     parameters = process_cli_arguments(argv)
     target=int(parameters[0])
+    delta=parameters[1]
+    set_format(parameters[2])
+    # finish the scan when stdout is closed, so the saved state is complete
+    keep_running_when_closed()
     count = 1
+    old_state = load_state(report_name)
+    new_state = {}
 
-    print ("\nV P C   R E P O R T\n")
-    print (f"List of VPC-s that have EC2/RDS or Lambdas combined less or equal then {target}.")
-    print ("")
+    write_text ("\nV P C   R E P O R T\n")
+    write_text (f"List of VPC-s that have EC2/RDS or Lambdas combined less or equal then {target}.")
+    write_text ("")
 
     for profile in global_config['profiles']:
-        session = boto3.Session(profile_name=profile)
-        available_regions = get_enabled_regions (session, "ec2")
+        session = get_session(profile)
+        available_regions = get_enabled_regions (session, "ec2", global_config.get('region_cache_ttl', default_ttl))
         for region in available_regions:
-            vpcs = get_vpc_info (session, region)
+            vpcs = list(get_vpc_info (session, region))
             if vpcs:
+                inventory = get_region_inventory (session, region)
                 for vpc in vpcs:
-                    ec2s = rdss = lams = 0
                     vpc_name = "-"
                     if 'Tags' in vpc:
                         vpc_name = get_name_tag (vpc['Tags'])
                     if vpc_name == "aws-controltower-VPC":
                         continue
-                    ec2s = get_number_of_ec2s(session, region, vpc['VpcId'])
-                    rdss = get_number_of_rdss(session, region, vpc['VpcId'])
-                    lams = get_number_of_lambdas(session, region, vpc['VpcId'])
-                    if ec2s+rdss+lams <= target:
-                        ngws = get_number_of_ngws(session, region, vpc['VpcId'])
-                        print (f"   {count:3d} - Profile: {profile:14}  Region: {region:16}  Vpc: {vpc['VpcId']:23}  CIDR: {vpc['CidrBlock']:18}  Name: {vpc_name}")
-                        if ec2s+rdss+lams+ngws > 0:
-                            print (f"            ec2: {ec2s:2}    rds: {rdss:2}    lambda: {lams:2}     ngws: {ngws}")
-                        count+=1
-    print ("\nEnd of report.")
+                    counts = [inventory[kind][vpc['VpcId']] for kind in ('ec2', 'rds', 'lambda', 'ngw')]
+                    # VPCs with unchanged configuration and counts are not evaluated again
+                    findings = evaluate(old_state, new_state, f"{profile}/{region}/{vpc['VpcId']}", [vpc, vpc_name, counts, target],
+                                        lambda: get_vpc_findings(profile, region, vpc, vpc_name, counts, target))
+                    if not delta:
+                        for finding in findings:
+                            line = f"   {count:3d} - {format_finding(finding)}"
+                            if sum(counts) > 0:
+                                line += f"\n            {format_counts(finding)}"
+                            write_record (finding, line)
+                            count+=1
+    save_state(report_name, new_state)
+    if delta:
+        print_delta(old_state, new_state, lambda f: f"{format_finding(f)}  {format_counts(f)}")
+    write_text ("\nEnd of report.")
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
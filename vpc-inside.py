@@ -2,10 +2,13 @@
 # https://gist.github.com/alonlavian/4f10ccb37aed9c20b208ae24e9f6ad2a
 #
 
-import logging
-import boto3
+import logging, threading
+from concurrent.futures import ThreadPoolExecutor
 from argparse import ArgumentParser, HelpFormatter
 from botocore.exceptions import ClientError, ProfileNotFound
+from aws_clients import get_session, get_client
+from aws_paging import iterate
+from report_output import formats, set_format, is_text, write_record
 
 # logger config
 logger = logging.getLogger()
@@ -16,36 +19,40 @@ logging.basicConfig(level=logging.INFO,
 formatter = lambda prog: HelpFormatter(prog, max_help_position=52)
 parser = ArgumentParser(formatter_class=formatter)
 # parser = ArgumentParser()
-parser.add_argument("-v", "--vpc", required=True, help="The VPC to describe")
+parser.add_argument("-v", "--vpc", action="append", help="The VPC to describe, can be repeated")
+parser.add_argument("-a", "--all-vpcs", action="store_true", help="Describe all VPCs in the region")
 parser.add_argument("-r", "--region", default="us-east-1", help="AWS region that the VPC resides in")
 parser.add_argument("-p", '--profile', default='default', help="AWS profile")
+parser.add_argument("-F", "--format", default="text", choices=formats, help="jsonl or csv writes resources as records to stdout")
 args = parser.parse_args()
+if not args.vpc and not args.all_vpcs:
+    parser.error("one of the arguments -v/--vpc -a/--all-vpcs is required")
 
 # boto client config
 try:
-    session = boto3.Session(profile_name=args.profile)
+    session = get_session(args.profile)
 except ProfileNotFound as e:
     logger.warning("{}, please provide a valid AWS profile name".format(e))
     exit(-1)
 
-vpc_client = session.client("ec2", region_name=args.region)
-elbV2_client = session.client('elbv2', region_name=args.region)
-elb_client = session.client('elb', region_name=args.region)
-lambda_client = session.client('lambda', region_name=args.region)
-eks_client = session.client('eks', region_name=args.region)
+vpc_client = get_client(session, "ec2", region_name=args.region)
+elbV2_client = get_client(session, 'elbv2', region_name=args.region)
+elb_client = get_client(session, 'elb', region_name=args.region)
+lambda_client = get_client(session, 'lambda', region_name=args.region)
+eks_client = get_client(session, 'eks', region_name=args.region)
 # ecs_client = session.client('ecs', region_name=args.region)
-asg_client = session.client('autoscaling', region_name=args.region)
-rds_client = session.client('rds', region_name=args.region)
+asg_client = get_client(session, 'autoscaling', region_name=args.region)
+rds_client = get_client(session, 'rds', region_name=args.region)
 ec2 = session.resource('ec2', region_name=args.region)
 
-vpc_id: str = args.vpc
+subnet_vpc_map = None
+subnet_vpc_map_lock = threading.Lock()
 
 
 def vpc_in_region():
     """
-    Describes one or more of your VPCs.
+    Describes one or more of your VPCs, returns their ids.
     """
-    vpc_exists = False
     try:
         vpcs = list(ec2.vpcs.filter(Filters=[]))
     except ClientError as e:
@@ -54,50 +61,63 @@ def vpc_in_region():
     logger.info("VPCs in region {}:".format(args.region))
     for vpc in vpcs:
         logger.info(vpc.id)
-        if vpc.id == vpc_id:
-            vpc_exists = True
 
     logger.info("--------------------------------------------")
-    return vpc_exists
+    return [vpc.id for vpc in vpcs]
 
 
-def describe_asgs():
-    logger.info("ASGs in VPC {}:".format(vpc_id))
-    asgs = asg_client.describe_auto_scaling_groups()['AutoScalingGroups']
-    for asg in asgs:
-        asg_name = asg['AutoScalingGroupName']
-        if asg_in_vpc(asg):
-            logger.info(asg_name)
+def vpc_filter(vpc_ids, name="vpc-id"):
+    """
+    Server side filter for the given VPCs, no filter when all VPCs of the region are described.
+    """
+    return {"Filters": [{"Name": name, "Values": vpc_ids}]} if vpc_ids else {}
 
-    logger.info("--------------------------------------------")
-    return
 
+def partition(items, get_vpc_ids, get_lines):
+    """
+    Returns {VpcId: [lines]} of items, get_vpc_ids(item) returns VPCs an item belongs to.
+    """
+    by_vpc = {}
+    for item in items:
+        for item_vpc_id in get_vpc_ids(item):
+            by_vpc.setdefault(item_vpc_id, []).extend(get_lines(item))
+    return by_vpc
 
-def asg_in_vpc(asg):
-    subnets_list = asg['VPCZoneIdentifier'].split(',')
-    for subnet in subnets_list:
-        try:
-            sub_description = vpc_client.describe_subnets(SubnetIds=[subnet])['Subnets']
-            if sub_description[0]['VpcId'] == vpc_id:
-                logger.info("{} resides in {}".format(asg['AutoScalingGroupName'], vpc_id))
-                return True
-        except ClientError:
-            pass
 
-    return False
+def describe_asgs(vpc_ids):
+    asgs = iterate(asg_client, 'describe_auto_scaling_groups', 'AutoScalingGroups')
+    return partition(asgs, asg_vpcs,
+                     lambda asg: ["{} resides in {}".format(asg['AutoScalingGroupName'], asg_vpcs(asg)[0]),
+                                  asg['AutoScalingGroupName']])
 
 
-def describe_ekss():
-    ekss = eks_client.list_clusters()['clusters']
+def get_subnet_vpc_map():
+    """
+    SubnetId -> VpcId map of the region, from one paginated subnet sweep
+    shared by all sections.
+    """
+    global subnet_vpc_map
+    with subnet_vpc_map_lock:
+        if subnet_vpc_map is None:
+            subnet_vpc_map = {subnet['SubnetId']: subnet['VpcId']
+                              for subnet in iterate(vpc_client, 'describe_subnets', 'Subnets')}
+    return subnet_vpc_map
 
-    logger.info("EKSs in VPC {}:".format(vpc_id))
-    for eks in ekss:
-        eks_desc = eks_client.describe_cluster(name=eks)['cluster']
-        if eks_desc['resourcesVpcConfig']['vpcId'] == vpc_id:
-            logger.info(eks_desc['name'])
 
-    logger.info("--------------------------------------------")
-    return
+def asg_vpcs(asg):
+    subnets_list = asg['VPCZoneIdentifier'].split(',')
+    subnet_vpcs = get_subnet_vpc_map()
+    return sorted({subnet_vpcs[subnet] for subnet in subnets_list if subnet in subnet_vpcs})
+
+
+def describe_ekss(vpc_ids):
+    ekss = list(iterate(eks_client, 'list_clusters', 'clusters'))
+
+    # describe_cluster takes one cluster, clusters are described concurrently
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        eks_descs = list(executor.map(lambda eks: eks_client.describe_cluster(name=eks)['cluster'], ekss))
+    return partition(eks_descs, lambda eks_desc: [eks_desc['resourcesVpcConfig']['vpcId']],
+                     lambda eks_desc: [eks_desc['name']])
 
 # def describe_ecss():
 #     ecss = ecs_client.list_clusters()['clusterArns']
@@ -113,235 +133,130 @@ def describe_ekss():
 #     logger.info("--------------------------------------------")
 #     return
 
-def describe_ec2s():
-    waiter = vpc_client.get_waiter('instance_terminated')
-    reservations = vpc_client.describe_instances(Filters=[{"Name": "vpc-id",
-                                                           "Values": [vpc_id]}])['Reservations']
-
-    # Get a list of ec2s
-    ec2s = [ec2['InstanceId'] for reservation in reservations for ec2 in reservation['Instances']]
-
-    logger.info("EC2s in VPC {}:".format(vpc_id))
-    for ec2 in ec2s:
-        logger.info(ec2)
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_lambdas():
-    lmbds = lambda_client.list_functions()['Functions']
-
-    lambdas_list = [lmbd['FunctionName'] for lmbd in lmbds
-                    if 'VpcConfig' in lmbd and lmbd['VpcConfig']['VpcId'] == vpc_id]
-
-    logger.info("Lambdas in VPC {}:".format(vpc_id))
-    for lmbda in lambdas_list:
-        logger.info(lmbda)
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_rdss():
-    rdss = rds_client.describe_db_instances()['DBInstances']
-
-    rdsss_list = [rds['DBInstanceIdentifier'] for rds in rdss if rds['DBSubnetGroup']['VpcId'] == vpc_id]
-
-    logger.info("RDSs in VPC {}:".format(vpc_id))
-    for rds in rdsss_list:
-        logger.info(rds)
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_elbs():
-    elbs = elb_client.describe_load_balancers()['LoadBalancerDescriptions']
-
-    elbs = [elb['LoadBalancerName'] for elb in elbs if elb['VPCId'] == vpc_id]
-
-    logger.info("Classic ELBs in VPC {}:".format(vpc_id))
-    for elb in elbs:
-        logger.info(elb)
+def describe_ec2s(vpc_ids):
+    ec2s = iterate(vpc_client, 'describe_instances', 'Reservations[].Instances[]', **vpc_filter(vpc_ids))
+    return partition(ec2s, lambda ec2: [ec2['VpcId']] if 'VpcId' in ec2 else [], lambda ec2: [ec2['InstanceId']])
 
-    logger.info("--------------------------------------------")
-    return
 
+def describe_lambdas(vpc_ids):
+    lmbds = iterate(lambda_client, 'list_functions', 'Functions')
+    return partition(lmbds, lambda lmbd: [lmbd['VpcConfig']['VpcId']] if 'VpcConfig' in lmbd else [],
+                     lambda lmbd: [lmbd['FunctionName']])
 
-def describe_elbsV2():
-    elbs = elbV2_client.describe_load_balancers()['LoadBalancers']
 
-    elbs_list = [elb['LoadBalancerArn'] for elb in elbs if elb['VpcId'] == vpc_id]
+def describe_rdss(vpc_ids):
+    rdss = iterate(rds_client, 'describe_db_instances', 'DBInstances')
+    return partition(rdss, lambda rds: [rds['DBSubnetGroup']['VpcId']] if 'DBSubnetGroup' in rds else [],
+                     lambda rds: [rds['DBInstanceIdentifier']])
 
-    logger.info("ELBs V2 in VPC {}:".format(vpc_id))
-    for elb in elbs_list:
-        logger.info(elb)
 
-    logger.info("--------------------------------------------")
-    return
+def describe_elbs(vpc_ids):
+    elbs = iterate(elb_client, 'describe_load_balancers', 'LoadBalancerDescriptions')
+    return partition(elbs, lambda elb: [elb['VPCId']] if 'VPCId' in elb else [], lambda elb: [elb['LoadBalancerName']])
 
 
-def describe_nats():
-    nats = vpc_client.describe_nat_gateways(Filters=[{"Name": "vpc-id",
-                                                      "Values": [vpc_id]}])['NatGateways']
+def describe_elbsV2(vpc_ids):
+    elbs = iterate(elbV2_client, 'describe_load_balancers', 'LoadBalancers')
+    return partition(elbs, lambda elb: [elb['VpcId']] if 'VpcId' in elb else [], lambda elb: [elb['LoadBalancerArn']])
 
-    nats = [nat['NatGatewayId'] for nat in nats]
-    logger.info("NAT GWs in VPC {}:".format(vpc_id))
-    for nat in nats:
-        logger.info(nat)
 
-    logger.info("--------------------------------------------")
-    return
+def describe_nats(vpc_ids):
+    nats = iterate(vpc_client, 'describe_nat_gateways', 'NatGateways', **vpc_filter(vpc_ids))
+    return partition(nats, lambda nat: [nat['VpcId']], lambda nat: [nat['NatGatewayId']])
 
 
-def describe_enis():
-    enis = vpc_client.describe_network_interfaces(Filters=[{"Name": "vpc-id", "Values": [vpc_id]}])['NetworkInterfaces']
+def describe_enis(vpc_ids):
+    enis = iterate(vpc_client, 'describe_network_interfaces', 'NetworkInterfaces', **vpc_filter(vpc_ids))
+    return partition(enis, lambda eni: [eni['VpcId']], lambda eni: [eni['NetworkInterfaceId']])
 
-    # Get a list of enis
-    enis = [eni['NetworkInterfaceId'] for eni in enis]
 
-    logger.info("ENIs in VPC {}:".format(vpc_id))
-    for eni in enis:
-        logger.info(eni)
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_igws():
+def describe_igws(vpc_ids):
     """
   Describe the internet gateway
   """
+    igws = iterate(vpc_client, 'describe_internet_gateways', 'InternetGateways',
+                   **vpc_filter(vpc_ids, "attachment.vpc-id"))
+    return partition(igws, lambda igw: [a['VpcId'] for a in igw.get('Attachments', [])],
+                     lambda igw: [igw['InternetGatewayId']])
 
-    # Get list of dicts
-    igws = vpc_client.describe_internet_gateways(
-        Filters=[{"Name": "attachment.vpc-id",
-                  "Values": [vpc_id]}])['InternetGateways']
-
-    igws = [igw['InternetGatewayId'] for igw in igws]
-
-    logger.info("IGWs in VPC {}:".format(vpc_id))
-    for igw in igws:
-        logger.info(igw)
 
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_vpgws():
+def describe_vpgws(vpc_ids):
     """
   Describe the virtual private gateway
   """
+    vpgws = iterate(vpc_client, 'describe_vpn_gateways', 'VpnGateways',
+                    **vpc_filter(vpc_ids, "attachment.vpc-id"))
+    return partition(vpgws, lambda vpgw: [a['VpcId'] for a in vpgw.get('VpcAttachments', [])],
+                     lambda vpgw: [vpgw['VpnGatewayId']])
 
-    # Get list of dicts
-    vpgws = vpc_client.describe_vpn_gateways(
-        Filters=[{"Name": "attachment.vpc-id",
-                  "Values": [vpc_id]}])['VpnGateways']
-
-    vpgws = [vpgw['VpnGatewayId'] for vpgw in vpgws]
 
-    logger.info("VPGWs in VPC {}:".format(vpc_id))
-    for vpgw in vpgws:
-        logger.info(vpgw)
-
-    logger.info("--------------------------------------------")
-    return
+def describe_subnets(vpc_ids):
+    return partition(get_subnet_vpc_map().items(), lambda subnet: [subnet[1]], lambda subnet: [subnet[0]])
 
 
-def describe_subnets():
-    # Get list of dicts of metadata
-    subnets = vpc_client.describe_subnets(Filters=[{"Name": "vpc-id",
-                                                    "Values": [vpc_id]}])['Subnets']
+def describe_acls(vpc_ids):
+    acls = iterate(vpc_client, 'describe_network_acls', 'NetworkAcls', **vpc_filter(vpc_ids))
+    return partition(acls, lambda acl: [acl['VpcId']], lambda acl: [acl['NetworkAclId']])
 
-    # Get a list of subnets
-    subnets = [subnet['SubnetId'] for subnet in subnets]
 
-    logger.info("Subnets in VPC {}:".format(vpc_id))
-    for subnet in subnets:
-        logger.info(subnet)
+def describe_sgs(vpc_ids):
+    sgs = iterate(vpc_client, 'describe_security_groups', 'SecurityGroups', **vpc_filter(vpc_ids))
+    return partition(sgs, lambda sg: [sg['VpcId']] if 'VpcId' in sg else [], lambda sg: [sg['GroupId']])
 
-    logger.info("--------------------------------------------")
-    return
 
+def describe_rtbs(vpc_ids):
+    rtbs = iterate(vpc_client, 'describe_route_tables', 'RouteTables', **vpc_filter(vpc_ids))
+    return partition(rtbs, lambda rtb: [rtb['VpcId']], lambda rtb: [rtb['RouteTableId']])
 
-def describe_acls():
-    acls = vpc_client.describe_network_acls(Filters=[{"Name": "vpc-id",
-                                                      "Values": [vpc_id]}])['NetworkAcls']
 
-    # Get a list of subnets
-    acls = [acl['NetworkAclId'] for acl in acls]
-    logger.info("ACLs in VPC {}:".format(vpc_id))
-    for acl in acls:
-        logger.info(acl)
+def describe_vpc_epts(vpc_ids):
+    epts = iterate(vpc_client, 'describe_vpc_endpoints', 'VpcEndpoints', **vpc_filter(vpc_ids))
+    return partition(epts, lambda ept: [ept['VpcId']], lambda ept: [ept['VpcEndpointId']])
 
-    logger.info("--------------------------------------------")
-    return
 
-
-def describe_sgs():
-    sgs = vpc_client.describe_security_groups(Filters=[{"Name": "vpc-id",
-                                                        "Values": [vpc_id]}])['SecurityGroups']
-
-    # Get a list of subnets
-    # sgs = [sg['GroupId'] for sg in sgs]
-    logger.info("Security Groups in VPC {}:".format(vpc_id))
-
-    for sg in sgs:
-        logger.info(sg['GroupId'])
-
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_rtbs():
-    rtbs = vpc_client.describe_route_tables(Filters=[{"Name": "vpc-id",
-                                                      "Values": [vpc_id]}])['RouteTables']
-    # Get a list of Routing tables
-    rtbs = [rtb['RouteTableId'] for rtb in rtbs]
-    logger.info("Routing tables in VPC {}:".format(vpc_id))
-    for rtb in rtbs:
-        logger.info(rtb)
-
-    logger.info("--------------------------------------------")
-    return
-
-
-def describe_vpc_epts():
-    epts = vpc_client.describe_vpc_endpoints(Filters=[{"Name": "vpc-id",
-                                                       "Values": [vpc_id]}])['VpcEndpoints']
-
-    # Get a list of Routing tables
-    epts = [ept['VpcEndpointId'] for ept in epts]
-    logger.info("VPC EndPoints in VPC {}:".format(vpc_id))
-    for ept in epts:
-        logger.info(ept)
-
-
-    logger.info("--------------------------------------------")
-    return
+# sections in the order they are printed, each lists its resources once
+# per region (or for the given VPCs) and partitions them by VpcId
+sections = [
+    ("EKSs in VPC {}:", describe_ekss),
+    # ("ECSs in VPC {}:", describe_ecss),
+    ("ASGs in VPC {}:", describe_asgs),
+    ("RDSs in VPC {}:", describe_rdss),
+    ("EC2s in VPC {}:", describe_ec2s),
+    ("Lambdas in VPC {}:", describe_lambdas),
+    ("Classic ELBs in VPC {}:", describe_elbs),
+    ("ELBs V2 in VPC {}:", describe_elbsV2),
+    ("NAT GWs in VPC {}:", describe_nats),
+    ("VPC EndPoints in VPC {}:", describe_vpc_epts),
+    ("IGWs in VPC {}:", describe_igws),
+    ("VPGWs in VPC {}:", describe_vpgws),
+    ("ENIs in VPC {}:", describe_enis),
+    ("Security Groups in VPC {}:", describe_sgs),
+    ("Routing tables in VPC {}:", describe_rtbs),
+    ("ACLs in VPC {}:", describe_acls),
+    ("Subnets in VPC {}:", describe_subnets),
+]
 
 
 if __name__ == '__main__':
 
-    if vpc_in_region():
-        describe_ekss()
-        # describe_ecss()
-        describe_asgs()
-        describe_rdss()
-        describe_ec2s()
-        describe_lambdas()
-        describe_elbs()
-        describe_elbsV2()
-        describe_nats()
-        describe_vpc_epts()
-        describe_igws()
-        describe_vpgws()
-        describe_enis()
-        describe_sgs()
-        describe_rtbs()
-        describe_acls()
-        describe_subnets()
-    else:
-        logger.info("The given VPC was not found in {}".format(args.region))
\ No newline at end of file
+    region_vpcs = vpc_in_region()
+    vpc_ids = region_vpcs if args.all_vpcs else [vpc_id for vpc_id in args.vpc if vpc_id in region_vpcs]
+    for vpc_id in args.vpc or []:
+        if vpc_id not in region_vpcs:
+            logger.info("The given VPC {} was not found in {}".format(vpc_id, args.region))
+
+    set_format(args.format)
+    if vpc_ids:
+        # collect all sections concurrently, print them in order as soon as each is ready
+        with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+            futures = [executor.submit(section, None if args.all_vpcs else vpc_ids) for _, section in sections]
+            for vpc_id in vpc_ids:
+                for (title, _), future in zip(sections, futures):
+                    if not is_text():
+                        for line in future.result().get(vpc_id, []):
+                            write_record({'vpc': vpc_id, 'section': title.split(" in VPC")[0], 'resource': line})
+                        continue
+                    logger.info(title.format(vpc_id))
+                    for line in future.result().get(vpc_id, []):
+                        logger.info(line)
+                    logger.info("--------------------------------------------")